@@ -0,0 +1,243 @@
+import os
+import sys
+import json
+import time
+import random
+import subprocess
+import argparse
+import tempfile
+import tracemalloc
+import glom
+
+CONSONANTS = 'ptkbdgmnszlrxh'
+VOWELS = 'aeiou'
+LETTERS = 'abcdefghijklmnopqrstuvwxyz'
+UPPER = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+RULE_TEMPLATES = ['{c1} -> {c2} / [+voc]_[+voc]',
+                  '{c1} -> {c2} / _#',
+                  '{c1} -> {c2} / #_',
+                  '{v1} -> {v2} / _',
+                  '{v1} -> {v2} / {c1}_',
+                  '{c1} -> @ / {c2}_',
+                  '@ -> {v1} / [+cons]_[+cons]',
+                  '[-voice,+cons] -> +voice / [-cons]_[-cons]']
+
+def make_name(j, alphabet, length=3):
+    """
+    Return a unique string of at least length letters for the number j
+    """
+    name = str()
+    while j or len(name) < length:
+        j, r = divmod(j, len(alphabet))
+        name = alphabet[r] + name
+    return name
+
+def make_morpheme(rng, syllables):
+    return ''.join(rng.choice(CONSONANTS) + rng.choice(VOWELS) for _ in range(syllables))
+
+def generate_corpus(path, sentences=10000, words_per_sentence=5, lexicon_size=5000, affixes=50,
+                    tables=10, nested_tables=10, rules=20, seed=0):
+    """
+    Write a synthetic dictionary directory, paradigm directory (with both 2D and nested tables),
+    sound change file and input file into path.
+    Returns a dictionary of the file and directory names, relative to path
+    """
+    rng = random.Random(seed)
+    names = {'dictionary_dir': 'dictionaries',
+             'paradigm_dir': 'paradigms',
+             'sound_change_file': 'sound_changes.txt',
+             'input_file': 'sentences.txt'}
+    os.makedirs(os.path.join(path, names['dictionary_dir']), exist_ok=True)
+    os.makedirs(os.path.join(path, names['paradigm_dir']), exist_ok=True)
+
+    roots = [make_name(j, LETTERS) for j in range(lexicon_size)]
+    with open(os.path.join(path, names['dictionary_dir'], 'roots.txt'), mode='w', encoding='utf-8') as f:
+        for root in roots:
+            print(f'{root},{make_morpheme(rng, rng.randint(1, 3))}', file=f)
+
+    affix_glosses = [make_name(j, UPPER) for j in range(affixes)]
+    with open(os.path.join(path, names['dictionary_dir'], 'affixes.txt'), mode='w', encoding='utf-8') as f:
+        for affix in affix_glosses:
+            print(f'{affix},{make_morpheme(rng, 1)}', file=f)
+
+    paradigm_glosses = list()
+    with open(os.path.join(path, names['paradigm_dir'], 'tables.txt'), mode='w', encoding='utf-8') as f:
+        for j in range(tables):
+            #a classic 2D table, with the name of the table in the top left corner
+            name = 'T' + make_name(j, UPPER)
+            columns = ['C' + make_name(k, UPPER, 1) for k in range(3)]
+            rows = ['R' + make_name(k, UPPER, 1) for k in range(4)]
+            print(','.join([name] + columns), file=f)
+            for row in rows:
+                print(','.join([row] + [make_morpheme(rng, 1) for _ in columns]), file=f)
+                paradigm_glosses.extend(f'{name}.{row}.{col}' for col in columns)
+            print(file=f)
+
+    with open(os.path.join(path, names['paradigm_dir'], 'nested.txt'), mode='w', encoding='utf-8') as f:
+        for j in range(nested_tables):
+            #one row per cell, every key except the last value is a level of nesting
+            name = 'N' + make_name(j, UPPER)
+            for a in ['PA', 'PB']:
+                for b in ['QA', 'QB', 'QC']:
+                    for c in ['SA', 'SB']:
+                        print(f'{name},{a},{b},{c},{make_morpheme(rng, 1)}', file=f)
+                        paradigm_glosses.append(f'{name}.{a}.{b}.{c}')
+            print(file=f)
+
+    with open(os.path.join(path, names['sound_change_file']), mode='w', encoding='utf-8') as f:
+        for j in range(rules):
+            template = RULE_TEMPLATES[j % len(RULE_TEMPLATES)]
+            c1, c2 = rng.sample(CONSONANTS, 2)
+            v1, v2 = rng.sample(VOWELS, 2)
+            print(template.format(c1=c1, c2=c2, v1=v1, v2=v2), file=f)
+
+    with open(os.path.join(path, names['input_file']), mode='w', encoding='utf-8') as f:
+        for j in range(sentences):
+            words = list()
+            for k in range(words_per_sentence):
+                word = [rng.choice(roots)]
+                if rng.random() < 0.3:
+                    word.insert(0, rng.choice(affix_glosses))
+                if rng.random() < 0.7:
+                    word.append(rng.choice(paradigm_glosses))
+                words.append('-'.join(word))
+            print(f'sentence number {j}\t{" ".join(words)}', file=f)
+
+    return names
+
+def run_stage(function, *args, memory=True):
+    """
+    Call function(*args) and return its result, the time it took in seconds, and
+    its peak memory use in bytes. Memory is measured in a second call, because tracing
+    allocations slows everything down.
+    """
+    start = time.perf_counter()
+    result = function(*args)
+    seconds = time.perf_counter() - start
+
+    peak = None
+    if memory:
+        tracemalloc.start()
+        function(*args)
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return result, seconds, peak
+
+def run_benchmark(path, names, file_format='text', compile_cascade=False, segbase_backend='python', memory=True):
+    """
+    Time each stage of the GLOM pipeline over the files in path.
+    Returns a dictionary of results, with one entry per stage
+    """
+    cwd = path
+    output_file = os.path.join(path, 'output.txt')
+    stages = dict()
+
+    lexicon, seconds, peak = run_stage(glom.read_dictionary_files, cwd, names['dictionary_dir'], 'gloss', memory=memory)
+    stages['read_dictionary_files'] = {'seconds': seconds, 'peak_bytes': peak}
+
+    paradigms, seconds, peak = run_stage(glom.read_paradigm_files, cwd, names['paradigm_dir'], 'rows', memory=memory)
+    stages['read_paradigm_files'] = {'seconds': seconds, 'peak_bytes': peak}
+
+    (glosses, translations), seconds, peak = run_stage(glom.read_input_file, cwd, names['input_file'], 'translation', memory=memory)
+    stages['read_input_file'] = {'seconds': seconds, 'peak_bytes': peak}
+
+    (morpheme_breakdowns, errors), seconds, peak = run_stage(glom.get_morphemes, glosses, lexicon, paradigms, memory=memory)
+    stages['get_morphemes'] = {'seconds': seconds, 'peak_bytes': peak}
+
+    top_lines, seconds, peak = run_stage(glom.apply_sound_changes, morpheme_breakdowns, cwd, names['sound_change_file'],
+                                         compile_cascade, None, segbase_backend, memory=memory)
+    stages['apply_sound_changes'] = {'seconds': seconds, 'peak_bytes': peak}
+
+    example, seconds, peak = run_stage(glom.generate_output_file, file_format, output_file, top_lines,
+                                       morpheme_breakdowns, glosses, translations, False, memory=memory)
+    stages['generate_output_file'] = {'seconds': seconds, 'peak_bytes': peak}
+
+    for stage in stages.values():
+        stage['sentences_per_second'] = len(glosses) / stage['seconds'] if stage['seconds'] else None
+    total = sum(stage['seconds'] for stage in stages.values())
+    return {'sentences': len(glosses),
+            'missing_morphemes': len(errors),
+            'total_seconds': total,
+            'sentences_per_second': len(glosses) / total if total else None,
+            'stages': stages}
+
+def measure_import_time(module='glom', repeat=5):
+    """
+    Return the time in seconds it takes a new Python interpreter to import module, not counting
+    the time it takes to start the interpreter. This is the fastest of repeat runs.
+    """
+    def run(code):
+        times = list()
+        for _ in range(repeat):
+            start = time.perf_counter()
+            subprocess.run([sys.executable, '-c', code], check=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+            times.append(time.perf_counter() - start)
+        return min(times)
+    return max(0.0, run(f'import {module}') - run('pass'))
+
+def print_report(report, previous=None):
+    print(f'{report["sentences"]} sentences, {report["total_seconds"]:.3f}s total, {report["sentences_per_second"]:.0f} sentences/s')
+    print(f'{"stage":<24}{"seconds":>10}{"sent/s":>12}{"peak MB":>10}', end='')
+    print(f'{"vs. previous":>14}' if previous else '')
+    for name, stage in report['stages'].items():
+        peak = f'{stage["peak_bytes"] / 1e6:.1f}' if stage['peak_bytes'] is not None else '-'
+        rate = f'{stage["sentences_per_second"]:.0f}' if stage['sentences_per_second'] else '-'
+        print(f'{name:<24}{stage["seconds"]:>10.4f}{rate:>12}{peak:>10}', end='')
+        if previous and name in previous['stages'] and stage['seconds']:
+            speedup = previous['stages'][name]['seconds'] / stage['seconds']
+            print(f'{speedup:>13.2f}x')
+        else:
+            print()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(prog='GLOM benchmark', description='Time each stage of GLOM on a synthetic corpus')
+    parser.add_argument('-s', '--sentences', dest='sentences', default=10000, type=int, help='Number of input sentences to generate')
+    parser.add_argument('-w', '--words_per_sentence', dest='words_per_sentence', default=5, type=int, help='Number of words in each sentence')
+    parser.add_argument('-l', '--lexicon_size', dest='lexicon_size', default=5000, type=int, help='Number of roots in the dictionary')
+    parser.add_argument('-a', '--affixes', dest='affixes', default=50, type=int, help='Number of affixes in the dictionary')
+    parser.add_argument('-t', '--tables', dest='tables', default=10, type=int, help='Number of 2D paradigm tables')
+    parser.add_argument('-nt', '--nested_tables', dest='nested_tables', default=10, type=int, help='Number of nested paradigm tables')
+    parser.add_argument('-r', '--rules', dest='rules', default=20, type=int, help='Number of sound change rules')
+    parser.add_argument('--seed', dest='seed', default=0, type=int, help='Random seed for the synthetic corpus')
+    parser.add_argument('-f', '--file_format', dest='file_format', default='text', help='Output file format to time')
+    parser.add_argument('-cc', '--compile_cascade', dest='compile_cascade', default=False, action='store_true', help='Compile the sound changes into a Cascade')
+    parser.add_argument('-sb', '--segbase_backend', dest='segbase_backend', default='python', help='Segbase backend, python or numpy')
+    parser.add_argument('--no_memory', dest='memory', default=True, action='store_false', help='Skip measuring peak memory, which runs every stage twice')
+    parser.add_argument('-d', '--data_dir', dest='data_dir', default=None, help='Write the synthetic corpus here instead of a temporary directory')
+    parser.add_argument('-j', '--json', dest='json_file', default=None, help='Save the results to this JSON file')
+    parser.add_argument('-c', '--compare', dest='compare', default=None, help='A JSON file from an earlier run to compare against')
+    parser.add_argument('-ib', '--import_budget', dest='import_budget', default=None, type=float, help='Exit with an error if "import glom" takes longer than this many milliseconds')
+    parser.add_argument('--import_only', dest='import_only', default=False, action='store_true', help='Only measure how long "import glom" takes, without running the benchmark')
+    args = parser.parse_args()
+
+    import_seconds = measure_import_time('glom')
+    print(f'import glom: {import_seconds * 1000:.1f}ms')
+    over_budget = args.import_budget is not None and import_seconds * 1000 > args.import_budget
+    if over_budget:
+        print(f'import glom is over the budget of {args.import_budget:.1f}ms')
+    if args.import_only:
+        sys.exit(1 if over_budget else 0)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = args.data_dir if args.data_dir else tmp
+        names = generate_corpus(path, args.sentences, args.words_per_sentence, args.lexicon_size, args.affixes,
+                                args.tables, args.nested_tables, args.rules, args.seed)
+        report = run_benchmark(path, names, args.file_format, args.compile_cascade, args.segbase_backend, args.memory)
+    report['import_seconds'] = import_seconds
+
+    report['settings'] = {key: value for key, value in vars(args).items() if key not in ['json_file', 'compare', 'data_dir', 'import_budget', 'import_only']}
+    report['python'] = sys.version.split()[0]
+
+    previous = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            previous = json.load(f)
+    print_report(report, previous)
+
+    if args.json_file:
+        with open(args.json_file, mode='w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+    if over_budget:
+        sys.exit(1)
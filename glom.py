@@ -1,19 +1,18 @@
 import os
 import sys
-import subprocess
 import re
 import argparse
-import sys
-from ursus.rules import Rule
+import collections
+import itertools
+import hashlib
+import io
+import json
+import sqlite3
+import time
+import unicodedata
+from ursus.rules import Rule, Cascade
 from ursus.segbase import Segbase
 
-try:
-    import fpdf
-except ImportError:
-    package = 'fpdf'
-    subprocess.check_call([sys.executable, "-m", "pip", "install", package])
-    __import__(package)
-
 def resource_path(relative_path):
     try:
         # PyInstaller creates a temp folder and stores path in _MEIPASS
@@ -23,13 +22,18 @@ def resource_path(relative_path):
 
     return os.path.join(base_path, relative_path)
 
-def query_lexicon(lexicon, morpheme, errors):
-    try:
-        result = lexicon[morpheme]
-    except KeyError:
-        lexicon[morpheme] = '?'
+def query_lexicon(lexicon, morpheme, errors, seen=None):
+    #the lexicon is only read, missing morphemes are collected in errors (once each) and come back as '?'
+    #seen is an optional set of the morphemes already in errors, so that long lists aren't searched every time
+    result = lexicon.get(morpheme)
+    if result is None:
         result = '?'
-        errors.append(morpheme)
+        if seen is None:
+            if morpheme not in errors:
+                errors.append(morpheme)
+        elif morpheme not in seen:
+            seen.add(morpheme)
+            errors.append(morpheme)
     return lexicon, result, errors
 
 def align_glosses(top_line, morpheme_breakdown, glosses, translation, number=0):
@@ -58,27 +62,158 @@ def align_glosses(top_line, morpheme_breakdown, glosses, translation, number=0):
 
     return '\n'.join([top_line, morphemes, gloss, translation, '\n']) #return extra newline for nice formatting
 
-def read_dictionary_files(cwd, dictionary_dir, dictionary_order):
-    lexicon = dict()
+def read_dictionary_file(path, dictionary_order, dictionary_dir='dictionaries'):
+    """
+    Return a list of (gloss, morpheme) pairs from one dictionary file, in the order they appear
+    """
+    try:
+        with open(path, encoding='utf-8') as f:
+            lines = [line.strip() for line in f if line.strip()]
+    except KeyError:
+        print(f'GLOM tried to open the dictionary file "\\dictionaries\\f{path}" but could not find it. Check the spelling and make sure you have a folder called "{dictionary_dir}"')
+        sys.exit()
+    sep = ',' if len(lines[0].split(',')) > 1 else '\t'
+    entries = list()
+    for line in lines:
+        if not line:
+            continue
+        gloss,morpheme = line.strip().replace('-','').split(sep)[:2] #ignore any other data for now
+        if dictionary_order.startswith('morph'):
+             gloss,morpheme = morpheme,gloss
+        entries.append((gloss, morpheme))
+    return entries
+
+def read_dictionary_files(cwd, dictionary_dir, dictionary_order, index_file=None):
+    """
+    Return a dictionary of gloss -> morpheme from every file in dictionary_dir.
+    If index_file is given, return a LexiconIndex stored in that file instead, which only
+    re-reads the dictionary files that changed since the last run.
+    """
     path = os.path.join(cwd, dictionary_dir)
     #path = resource_path(dictionary_dir)
+    if index_file:
+        return LexiconIndex(os.path.join(cwd, index_file), path, dictionary_order)
+
+    lexicon = dict()
     for file in os.listdir(path):
-        try:
-            with open(os.path.join(path, file), encoding='utf-8') as f:
-                lines = [line.strip() for line in f if line.strip()]
-        except KeyError:
-            print(f'GLOM tried to open the dictionary file "\\dictionaries\\f{os.path.join(path,file)}" but could not find it. Check the spelling and make sure you have a folder called "{dictionary_dir}"')
-            sys.exit()
-        sep = ',' if len(lines[0].split(',')) > 1 else '\t'
-        for line in lines:
-            if not line:
-                continue
-            gloss,morpheme = line.strip().replace('-','').split(sep)[:2] #ignore any other data for now
-            if dictionary_order.startswith('morph'):
-                 gloss,morpheme = morpheme,gloss
+        for gloss, morpheme in read_dictionary_file(os.path.join(path, file), dictionary_order, dictionary_dir):
             lexicon[gloss] = morpheme
     return lexicon
 
+class LexiconIndex:
+    """
+    A lexicon stored in an SQLite file, which can be used in place of the dictionary returned by
+    read_dictionary_files. Morphemes are looked up in the database when they are needed, instead of
+    loading every dictionary file into memory.
+    When the index is opened, only the dictionary files whose modification time and hash have
+    changed are read again. When a gloss is in more than one file, the same entry wins as with
+    read_dictionary_files (the last one, in the order the files are listed).
+    db_path : the SQLite file, created if it doesn't exist
+    dictionary_path : the directory of dictionary files
+    dictionary_order : 'gloss' or 'morpheme', see read_dictionary_files
+    Assigning to the index only changes it in memory.
+    """
+
+    def __init__(self, db_path, dictionary_path, dictionary_order):
+        self.db_path = db_path
+        self.dictionary_path = dictionary_path
+        self.dictionary_order = dictionary_order
+        self.found = dict()
+        self.connection = None
+        self.update()
+
+    def connect(self):
+        if self.connection is None:
+            self.connection = sqlite3.connect(self.db_path)
+            self.connection.executescript('''
+                CREATE TABLE IF NOT EXISTS settings (name TEXT PRIMARY KEY, value TEXT);
+                CREATE TABLE IF NOT EXISTS files (name TEXT PRIMARY KEY, mtime REAL, hash TEXT, rank INTEGER);
+                CREATE TABLE IF NOT EXISTS entries (gloss TEXT, morpheme TEXT, file TEXT, line INTEGER);
+                CREATE INDEX IF NOT EXISTS entries_gloss ON entries (gloss);
+                CREATE INDEX IF NOT EXISTS entries_file ON entries (file);
+            ''')
+        return self.connection
+
+    def update(self):
+        """
+        Bring the index up to date with the files in the dictionary directory.
+        Returns the names of the files that were read again.
+        """
+        db = self.connect()
+        order = db.execute("SELECT value FROM settings WHERE name = 'dictionary_order'").fetchone()
+        if order is None or order[0] != self.dictionary_order:
+            #every entry was read the other way around, start over
+            db.execute('DELETE FROM files')
+            db.execute('DELETE FROM entries')
+            db.execute("INSERT OR REPLACE INTO settings VALUES ('dictionary_order', ?)", (self.dictionary_order,))
+
+        known = {name: (mtime, hash_) for name, mtime, hash_ in db.execute('SELECT name, mtime, hash FROM files')}
+        files = os.listdir(self.dictionary_path)
+        changed = list()
+        for rank, file in enumerate(files):
+            path = os.path.join(self.dictionary_path, file)
+            mtime = os.path.getmtime(path)
+            if file in known and known[file][0] == mtime:
+                db.execute('UPDATE files SET rank = ? WHERE name = ?', (rank, file))
+                continue
+            with open(path, 'rb') as f:
+                hash_ = hashlib.sha1(f.read()).hexdigest()
+            if file in known and known[file][1] == hash_:
+                db.execute('UPDATE files SET rank = ?, mtime = ? WHERE name = ?', (rank, mtime, file))
+                continue
+            entries = read_dictionary_file(path, self.dictionary_order)
+            db.execute('DELETE FROM entries WHERE file = ?', (file,))
+            db.executemany('INSERT INTO entries VALUES (?, ?, ?, ?)',
+                           ((gloss, morpheme, file, line) for line, (gloss, morpheme) in enumerate(entries)))
+            db.execute('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)', (file, mtime, hash_, rank))
+            changed.append(file)
+
+        for file in set(known) - set(files):
+            db.execute('DELETE FROM entries WHERE file = ?', (file,))
+            db.execute('DELETE FROM files WHERE name = ?', (file,))
+            changed.append(file)
+        db.commit()
+        self.found = dict()
+        return changed
+
+    def __getitem__(self, gloss):
+        try:
+            return self.found[gloss]
+        except KeyError:
+            pass
+        row = self.connect().execute('''SELECT entries.morpheme FROM entries JOIN files ON entries.file = files.name
+                                        WHERE entries.gloss = ? ORDER BY files.rank DESC, entries.line DESC LIMIT 1''',
+                                     (gloss,)).fetchone()
+        if row is None:
+            raise KeyError(gloss)
+        self.found[gloss] = row[0]
+        return row[0]
+
+    def __setitem__(self, gloss, morpheme):
+        self.found[gloss] = morpheme
+
+    def __contains__(self, gloss):
+        try:
+            self[gloss]
+        except KeyError:
+            return False
+        return True
+
+    def get(self, gloss, default=None):
+        try:
+            return self[gloss]
+        except KeyError:
+            return default
+
+    def __len__(self):
+        return self.connect().execute('SELECT COUNT(DISTINCT gloss) FROM entries').fetchone()[0]
+
+    def __getstate__(self):
+        #sqlite connections can't be sent to worker processes, each one opens its own
+        state = self.__dict__.copy()
+        state['connection'] = None
+        return state
+
 def read_paradigm_files(cwd, paradigm_dir, table_order):
     paradigms = dict()
     paradigm_dir = os.path.join(cwd, paradigm_dir)
@@ -133,141 +268,714 @@ def read_paradigm_files(cwd, paradigm_dir, table_order):
 
     return paradigms
 
+class ParadigmError(KeyError):
+    """
+    Raised when a gloss like NOM.SG.ANIM can't be found in any paradigm.
+    gloss : the gloss that couldn't be found
+    closest : the longest part of the gloss that could be found, e.g. NOM.SG, or '' if nothing matched
+    options : the keys that can follow closest
+    word : the whole word that the gloss came from, if known
+    """
+
+    def __init__(self, gloss, closest, options, word=None):
+        super().__init__(gloss, closest, options, word)
+        self.gloss = gloss
+        self.closest = closest
+        self.options = options
+        self.word = word
+
+    def __str__(self):
+        if self.closest:
+            return f'{self.gloss} (the closest match is {self.closest}, which can be followed by {", ".join(self.options)})'
+        return f'{self.gloss} (no paradigm starts with {self.gloss.split(".")[0]})'
+
+class ParadigmIndex(dict):
+    """
+    The paradigms from read_paradigm_files, flattened into a dictionary from the full gloss
+    (e.g. NOM.SG.ANIM) to the morpheme, so that each lookup is a single dictionary access.
+    Use compile_paradigms to make one, and save/load to keep it in a file.
+    """
+
+    def lookup(self, gloss, word=None):
+        try:
+            return self[gloss]
+        except KeyError:
+            closest, options = self.closest(gloss)
+            raise ParadigmError(gloss, closest, options, word) from None
+
+    def closest(self, gloss):
+        """
+        Return the longest part of gloss that starts at least one key in the index,
+        and a sorted list of the keys that could come next
+        """
+        keys = gloss.split('.')
+        for n in range(len(keys), 0, -1):
+            prefix = '.'.join(keys[:n])
+            options = {key[len(prefix)+1:].split('.')[0] for key in self if key.startswith(prefix + '.')}
+            if options:
+                return prefix, sorted(options)
+        return '', sorted({key.split('.')[0] for key in self})
+
+    def save(self, path):
+        with open(path, mode='w', encoding='utf-8') as f:
+            json.dump(self, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, encoding='utf-8') as f:
+            return cls(json.load(f))
+
+def compile_paradigms(paradigms):
+    """
+    Turn the nested dictionaries from read_paradigm_files into a ParadigmIndex
+    """
+    index = ParadigmIndex()
+    levels = [('', paradigms)]
+    while levels:
+        prefix, level = levels.pop()
+        for key, value in level.items():
+            gloss = prefix + '.' + key if prefix else key
+            if isinstance(value, dict):
+                levels.append((gloss, value))
+            else:
+                index[gloss] = value
+    return index
+
 def paradigm_lookup(sequence, dictionary):
+    if isinstance(dictionary, ParadigmIndex):
+        return dictionary.lookup(sequence)
+
     keys = sequence.split(".")
     result = dictionary
     for key in keys:
         result = result[key]
     return result
 
-def get_morphemes(glosses, lexicon, paradigms):
+def report_paradigm_error(error):
+    print(f'Something went wrong trying to read your input file.')
+    if error.word is not None:
+        print(f'While reading this gloss:{error.word}')
+    print(f'GLOM encountered an error on this particular item:{error.gloss}')
+    if error.closest:
+        print(f'The closest match GLOM could find was {error.closest}, which can be followed by: {", ".join(error.options)}')
+    print('One of the following things probably happened:')
+    print('- Simple spelling mistake. Maybe you typed INFL instead of INF, or 1POSS instead of 1.POSS')
+    print('- Inconsistent glossing. Maybe you used "SG" for singular in one place and "SING" in another')
+    print('- One of your paradigm files might have an extra comma or tab at the end of a line. Delete these.')
+    print('- You might have reversed the order of information in a table. GLOM reads rows before columns by default, run with "--table_order column" if you prefer the columns first.')
+    print('- You might have forgotten an element in your gloss. If your nominative case inflects for number and gender, make sure they are both included.')
+
+def get_word_morphemes(word, lexicon, paradigms, errors, dependencies=None, seen=None):
+    """
+    Look up every morpheme in one glossed word, like witness-NOM.SG.ANIM
+    Returns the morphemes joined by hyphens, and a list of the morphemes that were
+    replaced by '?' because they are not in the lexicon
+    dependencies : optional dictionary with 'lexicon' and 'paradigms' dictionaries, which are
+    filled in with every entry that was used (None for missing lexicon entries)
+    seen : optional set of the morphemes in errors, see query_lexicon
+    """
+    new_word = list()
+    missing = list()
+    for morpheme in word.strip().split('-'):
+        if morpheme.isupper() and '.' in morpheme:
+            try:
+                morph = paradigm_lookup(morpheme, paradigms)
+                if isinstance(morph, dict):
+                    raise KeyError(morpheme) #the gloss stops part way through a paradigm
+            except ParadigmError as e:
+                e.word = word
+                raise
+            except KeyError:
+                #nested paradigms from read_paradigm_files, find out how far the gloss got
+                closest, options = compile_paradigms(paradigms).closest(morpheme)
+                raise ParadigmError(morpheme, closest, options, word) from None
+            new_word.append(morph)
+            if dependencies is not None:
+                dependencies['paradigms'][morpheme] = morph
+        else:
+            #lexical items, and grammatical morphemes that aren't in a paradigm
+            lexicon, result, errors = query_lexicon(lexicon, morpheme, errors, seen)
+            new_word.append(result)
+            if result == '?':
+                missing.append(morpheme)
+            if dependencies is not None:
+                dependencies['lexicon'][morpheme] = result if result != '?' else None
+    return '-'.join(new_word), missing
+
+def get_morphemes(glosses, lexicon, paradigms, cache=None):
+    """
+    Look up the morphemes for each sentence in glosses.
+    cache is an optional LRUCache of glossed word -> (morphemes, missing morphemes), so that
+    words which appear many times are only looked up once. Use a new cache (or clear it) if
+    the lexicon or paradigms change.
+    Returns a list of morpheme breakdowns, one per sentence, and a list of missing morphemes
+    """
     output = list()
     errors = list()
+    seen = set()
     for g in glosses:
         new_sentence = list()
         for word in g.split():
-            new_word = list()
-            for morpheme in word.strip().split('-'):
-                if morpheme.islower():
-                    lexicon, result, errors = query_lexicon(lexicon, morpheme, errors)
-                    new_word.append(result)
-                elif morpheme.isupper():
-                    try:
-                        if '.' in morpheme:
-                            morph = paradigm_lookup(morpheme, paradigms)
-                            new_word.append(morph)
-                            # morphs = morpheme.split('.')
-                            # paradigm = morphs[0]
-                            # row = morphs[1]
-                            # try:
-                            #     col = morphs[2]
-                            # except IndexError:
-                            #     col = None
-                            # if col is not None:
-                            #     new_word.append(paradigms[paradigm][row][col])
-                            # else:
-                            #     new_word.append(paradigms[paradigm][row])
-                        else:
-                            lexicon, result, errors = query_lexicon(lexicon, morpheme, errors)
-                            new_word.append(result)
-                    except KeyError as e:
-                        if not e:
-                            continue
-                        print(f'Something went wrong trying to read your input file.')
-                        print(f'While reading this gloss:{word}')
-                        print(f'GLOM encountered an error on this particular item:{e}')
-                        print('One of the following things probably happened:')
-                        print('- Simple spelling mistake. Maybe you typed INFL instead of INF, or 1POSS instead of 1.POSS')
-                        print('- Inconsistent glossing. Maybe you used "SG" for singular in one place and "SING" in another')
-                        print('- One of your paradigm files might have an extra comma or tab at the end of a line. Delete these.')
-                        print('- You might have reversed the order of information in a table. GLOM reads rows before columns by default, run with "--table_order column" if you prefer the columns first.')
-                        print('- You might have forgotten an element in your gloss. If your nominative case inflects for number and gender, make sure they are both included.')
-                        quit()
-                else:
-                    lexicon, result, errors = query_lexicon(lexicon, morpheme, errors)
-                    new_word.append(result)
-            new_word = '-'.join(new_word)
+            cached = cache.get(word) if cache is not None else None
+            if cached is None:
+                new_word, missing = get_word_morphemes(word, lexicon, paradigms, errors, seen=seen)
+                if cache is not None:
+                    cache.put(word, (new_word, missing))
+            else:
+                new_word, missing = cached
+                for morpheme in missing:
+                    #report each missing morpheme once, as if it had been looked up
+                    lexicon, result, errors = query_lexicon(lexicon, morpheme, errors, seen)
             new_sentence.append(new_word)
         new_sentence = ' '.join(new_sentence)
         output.append(new_sentence)
     return output, errors
 
-def read_input_file(cwd, input_file, input_order):
+def iter_input_file(cwd, input_file, input_order):
+    """
+    Yield (gloss, translation) pairs from the input file one line at a time,
+    without reading the whole file into memory
+    """
     try:
-        with open(os.path.join(cwd, input_file), encoding='utf-8') as f:
-        #with open(resource_path(input_file), encoding='utf-8') as f:
-            lines = [line.strip() for line in f]
+        f = open(os.path.join(cwd, input_file), encoding='utf-8')
+        #f = open(resource_path(input_file), encoding='utf-8')
     except FileNotFoundError:
         print(f'GLOM tried opening the intput file "{input_file}" but could not find it. Make sure the name is typed correctly, and that it is in the same folder as GLOM.')
         sys.exit()
 
+    with f:
+        sep = None
+        for line in f:
+            line = line.strip()
+            if sep is None:
+                sep = ',' if len(line.split(',')) > 1 else '\t'
+            if not line:
+                continue
+            line = line.split(sep)
+
+            if len(line) == 1:
+                gloss = line[0]
+                translation = ''
+            else:
+                gloss,translation = line
+                if input_order == 'translation':
+                     gloss,translation = translation,gloss
+            yield gloss, translation
+
+def read_input_file(cwd, input_file, input_order):
     glosses = list()
     translations = list()
-    sep = ',' if len(lines[0].split(',')) > 1 else '\t'
+    for gloss, translation in iter_input_file(cwd, input_file, input_order):
+        glosses.append(gloss)
+        translations.append(translation)
+    return glosses, translations
 
-    for line in lines:
-        if not line:
+def display_width(text):
+    """
+    Return the number of columns text takes up in a monospaced font. East Asian wide characters
+    take up two columns, and combining diacritics and other zero-width characters take up none.
+    """
+    width = 0
+    for character in text:
+        if unicodedata.combining(character) or unicodedata.category(character) in ('Mn', 'Me', 'Cf'):
             continue
-        line = line.split(sep)
+        width += 2 if unicodedata.east_asian_width(character) in ('W', 'F') else 1
+    return width
+
+class InterlinearWriter:
+    """
+    Writes aligned examples to a text file, in the same layout as align_glosses.
+    Each morpheme line and gloss line is built in one pass, and examples are collected in a buffer
+    that is only written to the file once it holds buffer_size characters.
+    f : a text file opened for writing
+    wide : if True, pad columns by their display width (see display_width) instead of the
+    number of characters, so that CJK text and stacked diacritics line up
+    """
+
+    def __init__(self, f, wide=False, buffer_size=1<<16):
+        self.f = f
+        self.wide = wide
+        self.buffer_size = buffer_size
+        self.buffer = list()
+        self.buffered = 0
 
-        if len(line) == 1:
-            gloss = line[0]
-            translation = ''
+    def align(self, morphemes, glosses):
+        if self.wide:
+            morpheme_widths = [display_width(word) for word in morphemes]
+            gloss_widths = [display_width(word) for word in glosses]
+            widths = [max(m, g) + 1 for m, g in zip(morpheme_widths, gloss_widths)]
+            morpheme_line = ''.join([word + ' ' * (width - w) for word, w, width in zip(morphemes, morpheme_widths, widths)])
+            gloss_line = ''.join([word + ' ' * (width - w) for word, w, width in zip(glosses, gloss_widths, widths)])
         else:
-            gloss,translation = line
-            if input_order == 'translation':
-                 gloss,translation = translation,gloss
-        glosses.append(gloss)
-        translations.append(translation)
-    return glosses, translations
+            #every column is one space wider than its longest word, so ' '.join + ' ' is the same as padding by one more
+            widths = list(map(max, map(len, morphemes), map(len, glosses)))
+            if not widths:
+                return str(), str()
+            morpheme_line = ' '.join(map(str.ljust, morphemes, widths)) + ' '
+            gloss_line = ' '.join(map(str.ljust, glosses, widths)) + ' '
+        return morpheme_line, gloss_line
+
+    def write(self, top_line, morpheme_breakdown, gloss, translation, number=0):
+        """
+        Add one example to the buffer, and return it as text (without the blank lines that follow it)
+        """
+        morpheme_line, gloss_line = self.align(morpheme_breakdown.split(), gloss.split())
+        if number:
+            prefix = f'{number}. '
+            indent = ' ' * len(prefix)
+            example = f'{prefix}{top_line}\n{indent}{morpheme_line}\n{indent}{gloss_line}\n{indent}{translation}'
+        else:
+            example = f'{top_line}\n{morpheme_line}\n{gloss_line}\n{translation}'
+        self.buffer.append(example)
+        self.buffer.append('\n\n\n')
+        self.buffered += len(example) + 3
+        if self.buffered >= self.buffer_size:
+            self.flush()
+        return example
+
+    def flush(self):
+        self.f.write(''.join(self.buffer))
+        self.buffer.clear()
+        self.buffered = 0
+
+PDF_FONT_FILES = ['DejaVuSansMono.ttf', 'NotoSansMono-Regular.ttf', 'FreeMono.ttf', 'LiberationMono-Regular.ttf']
+PDF_FONT_DIRS = [resource_path('fonts'),
+                 '/usr/share/fonts/truetype/dejavu',
+                 '/usr/share/fonts/dejavu',
+                 '/usr/share/fonts/TTF',
+                 '/usr/share/fonts/truetype/noto',
+                 '/usr/share/fonts/truetype/freefont',
+                 '/usr/share/fonts/truetype/liberation',
+                 '/Library/Fonts',
+                 os.path.expanduser('~/Library/Fonts'),
+                 os.path.join(os.environ.get('WINDIR', 'C:\\Windows'), 'Fonts')]
+
+def find_pdf_font():
+    """
+    Return the path of a monospaced TrueType font with IPA characters, or None if there isn't one installed
+    """
+    for name in PDF_FONT_FILES:
+        for directory in PDF_FONT_DIRS:
+            path = os.path.join(directory, name)
+            if os.path.exists(path):
+                return path
+    return None
+
+class PDFWriter:
+    """
+    Writes examples (formatted by align_glosses) to a PDF file.
+    font_file : a TrueType font to embed, so that IPA characters show up. Only the characters that
+    are used are embedded. If None, find_pdf_font is used, and if that finds nothing the built-in
+    Courier font is used instead, with characters it doesn't have replaced by '?'.
+    chunk_pages : if more than 0, every chunk_pages pages are written out to their own file and a new
+    document is started, so that memory use doesn't grow with the size of the input. When the
+    pypdf package is installed the parts are merged into output_file at the end, otherwise they
+    are kept as output-1.pdf, output-2.pdf, etc.
+    """
+
+    def __init__(self, output_file, font_file=None, chunk_pages=0, font_size=10, line_height=5):
+        self.output_file = output_file
+        self.font_file = font_file if font_file else find_pdf_font()
+        if font_file and not os.path.exists(font_file):
+            print(f'You specified a PDF font called "{font_file}" but GLOM could not find it. Double check the name and spelling.')
+            sys.exit()
+        self.chunk_pages = chunk_pages
+        self.font_size = font_size
+        self.line_height = line_height
+        self.parts = list()
+        self.pdf = None
+
+    def new_document(self):
+        #fpdf is only imported for PDF output, so that text output doesn't have to wait for it
+        try:
+            import fpdf
+        except ImportError:
+            print('GLOM needs the fpdf package to write PDF files. Install it with "pip install fpdf", or choose another file format.')
+            sys.exit()
+        self.pdf = fpdf.FPDF()
+        if self.font_file:
+            self.pdf.add_font('GLOM', '', self.font_file, uni=True)
+            self.pdf.set_font('GLOM', size=self.font_size)
+        else:
+            self.pdf.set_font('Courier', size=self.font_size)
+        self.pdf.add_page()
+
+    def finish_document(self):
+        path = f'{os.path.splitext(self.output_file)[0]}.part{len(self.parts)+1}.pdf' if self.chunk_pages else self.output_file
+        self.pdf.output(path)
+        self.parts.append(path)
+        self.pdf = None
+
+    def write(self, example):
+        if self.pdf is None:
+            self.new_document()
+        if not self.font_file:
+            example = example.encode('latin-1', errors='replace').decode('latin-1')
+        lines = example.count('\n') + 1
+        if self.pdf.get_y() + self.line_height * lines > self.pdf.page_break_trigger:
+            if self.chunk_pages and self.pdf.page_no() >= self.chunk_pages:
+                self.finish_document()
+                self.new_document()
+            else:
+                self.pdf.add_page()
+        self.pdf.multi_cell(0, self.line_height, txt=example)
+
+    def close(self):
+        """
+        Write the last document and merge the parts. Returns the list of files that were written
+        """
+        if self.pdf is None:
+            self.new_document()
+        self.finish_document()
+        if not self.chunk_pages:
+            return self.parts
+        if len(self.parts) == 1:
+            os.replace(self.parts[0], self.output_file)
+            return [self.output_file]
+        try:
+            import pypdf
+        except ImportError:
+            base, extension = os.path.splitext(self.output_file)
+            files = list()
+            for j, part in enumerate(self.parts, start=1):
+                files.append(f'{base}-{j}{extension}')
+                os.replace(part, files[-1])
+            print(f'Your PDF was split into {len(files)} files, {files[0]} to {files[-1]}. Install the pypdf package to have GLOM merge them into one file.')
+            return files
+        writer = pypdf.PdfWriter()
+        for part in self.parts:
+            writer.append(part)
+        with open(self.output_file, mode='wb') as f:
+            writer.write(f)
+        for part in self.parts:
+            os.remove(part)
+        return [self.output_file]
+
+def split_words(record):
+    """
+    Split a record into words. Returns a list of (surface form, morphemes, glosses) tuples, where
+    the surface form comes from the top line and morphemes and glosses are lists. Missing values are None.
+    """
+    top_words = record['top_line'].split()
+    morpheme_words = record['morphemes'].split()
+    gloss_words = record['gloss'].split()
+    words = list()
+    for top_word, morpheme_word, gloss_word in itertools.zip_longest(top_words, morpheme_words, gloss_words):
+        morphemes = morpheme_word.split('-') if morpheme_word is not None else list()
+        glosses = gloss_word.split('-') if gloss_word is not None else list()
+        words.append((top_word, morphemes, glosses))
+    return words
+
+class Emitter:
+    """
+    Base class for output formats. An emitter is created with the name of the output file, given one
+    record at a time by write, and closed at the end, so it never needs to see the whole input.
+    A record is a dictionary with the keys number (0 if sentences aren't numbered), top_line,
+    morphemes, gloss and translation.
+    write returns the example as it appears in the output, for --print_one.
+    New formats can be added with register_emitter.
+    """
+    extension = '.txt'
+
+    def __init__(self, output_file, **options):
+        self.output_file = output_file
+        self.f = open(output_file, mode='w', encoding='utf-8')
+
+    def write(self, record):
+        raise NotImplementedError
 
-def generate_output_file(file_format, output_file, top_lines, morpheme_breakdowns, glosses, translations, add_sentence_numbers):
+    def close(self):
+        self.f.close()
 
+class TextEmitter(Emitter):
+    """
+    Aligned plain text, see InterlinearWriter. Options: wide_padding, and flush_every (the file is
+    flushed every flush_every examples, so streamed output shows up as it is written)
+    """
+    extension = '.txt'
+
+    def __init__(self, output_file, wide_padding=False, flush_every=1000, **options):
+        super().__init__(output_file)
+        self.writer = InterlinearWriter(self.f, wide_padding)
+        self.flush_every = flush_every
+        self.count = 0
+
+    def write(self, record):
+        example = self.writer.write(record['top_line'], record['morphemes'], record['gloss'], record['translation'], record['number'])
+        self.count += 1
+        if self.count % self.flush_every == 0:
+            self.writer.flush()
+            self.f.flush()
+        return example + '\n\n'
+
+    def close(self):
+        self.writer.flush()
+        super().close()
+
+class PDFEmitter(Emitter):
+    """
+    A PDF of aligned examples, see PDFWriter. Options: pdf_font and pdf_chunk_pages
+    """
+    extension = '.pdf'
+
+    def __init__(self, output_file, pdf_font=None, pdf_chunk_pages=0, **options):
+        self.output_file = output_file
+        self.writer = PDFWriter(output_file, pdf_font, pdf_chunk_pages)
+
+    def write(self, record):
+        example = align_glosses(record['top_line'], record['morphemes'], record['gloss'], record['translation'], record['number'])
+        self.writer.write(example)
+        return example
+
+    def close(self):
+        self.writer.close()
+
+class JSONLEmitter(Emitter):
+    """
+    One JSON object per line, with the fields of the record and a list of words, each with its
+    surface form, morphemes and glosses
+    """
+    extension = '.jsonl'
+
+    def write(self, record):
+        words = [{'form': form, 'morphemes': morphemes, 'glosses': glosses} for form, morphemes, glosses in split_words(record)]
+        line = json.dumps(dict(record, words=words), ensure_ascii=False)
+        self.f.write(line + '\n')
+        return line
+
+class TSVEmitter(Emitter):
+    """
+    One row per morpheme, in the style of CoNLL-U: each sentence starts with comment lines for its
+    id, text and translation, and ends with a blank line. The columns are word number, morpheme number,
+    surface form of the word, morpheme and gloss, and missing values are written as _
+    """
+    extension = '.tsv'
+
+    def __init__(self, output_file, **options):
+        super().__init__(output_file)
+        self.sentence_id = 0
+
+    def write(self, record):
+        self.sentence_id += 1
+        lines = [f'# sent_id = {record["number"] or self.sentence_id}',
+                 f'# text = {record["top_line"]}',
+                 f'# translation = {record["translation"]}']
+        for j, (form, morphemes, glosses) in enumerate(split_words(record), start=1):
+            for k, (morpheme, gloss) in enumerate(itertools.zip_longest(morphemes, glosses), start=1):
+                lines.append('\t'.join([str(j), str(k), form or '_', morpheme or '_', gloss or '_']))
+        example = '\n'.join(lines)
+        self.f.write(example + '\n\n')
+        return example
+
+LATEX_SPECIAL_CHARACTERS = {'\\': r'\textbackslash{}', '&': r'\&', '%': r'\%', '$': r'\$', '#': r'\#',
+                            '_': r'\_', '{': r'\{', '}': r'\}', '~': r'\textasciitilde{}', '^': r'\textasciicircum{}'}
+
+def escape_latex(text):
+    return ''.join(LATEX_SPECIAL_CHARACTERS.get(character, character) for character in text)
+
+class GB4EEmitter(Emitter):
+    """
+    LaTeX examples for the gb4e package, in a single exe environment so that they are numbered in order.
+    The file is meant to be \\input into a document that loads gb4e. Use XeLaTeX or LuaLaTeX, with a font
+    that has IPA characters.
+    """
+    extension = '.tex'
+
+    def __init__(self, output_file, **options):
+        super().__init__(output_file)
+        self.f.write('% Glossed examples from GLOM, for \\usepackage{gb4e}\n\\begin{exe}\n')
+
+    def write(self, record):
+        top_line, morphemes, gloss, translation = [escape_latex(record[key]) for key in ['top_line', 'morphemes', 'gloss', 'translation']]
+        example = f"\\ex\n\\glll {top_line}\\\\\n{morphemes}\\\\\n{gloss}\\\\\n\\trans `{translation}'"
+        self.f.write(example + '\n\n')
+        return example
+
+    def close(self):
+        self.f.write('\\end{exe}\n')
+        super().close()
+
+class ExpexEmitter(Emitter):
+    """
+    LaTeX examples for the expex package, meant to be \\input into a document that loads expex
+    """
+    extension = '.tex'
+
+    def __init__(self, output_file, **options):
+        super().__init__(output_file)
+        self.f.write('% Glossed examples from GLOM, for \\usepackage{expex}\n\n')
+
+    def write(self, record):
+        top_line, morphemes, gloss, translation = [escape_latex(record[key]) for key in ['top_line', 'morphemes', 'gloss', 'translation']]
+        example = f"\\ex\n\\begingl\n\\glpreamble {top_line}//\n\\gla {morphemes}//\n\\glb {gloss}//\n\\glft `{translation}'//\n\\endgl\n\\xe"
+        self.f.write(example + '\n\n')
+        return example
+
+EMITTERS = {'text': TextEmitter,
+            'txt': TextEmitter,
+            'pdf': PDFEmitter,
+            'jsonl': JSONLEmitter,
+            'tsv': TSVEmitter,
+            'gb4e': GB4EEmitter,
+            'latex': GB4EEmitter,
+            'expex': ExpexEmitter}
+
+def register_emitter(file_format, emitter):
+    """
+    Add an output format. emitter is a subclass of Emitter
+    """
+    EMITTERS[file_format] = emitter
+
+def write_examples(file_format, output_file, examples, add_sentence_numbers, flush_every=1000, wide_padding=False,
+                   pdf_font=None, pdf_chunk_pages=0):
+    """
+    Write examples to output_file as they arrive. examples can be any iterable (including a generator)
+    of (top_line, morpheme_breakdown, gloss, translation) tuples.
+    file_format : one of the formats in EMITTERS. The extension of output_file is changed to match.
+    The other arguments are options for the emitters, see TextEmitter and PDFEmitter.
+    Returns the last example, formatted for the output file
+    """
+    try:
+        emitter_class = EMITTERS[file_format]
+    except KeyError:
+        print(f'GLOM does not know the file format "{file_format}". The options are: {", ".join(EMITTERS)}')
+        sys.exit()
+    if not output_file.endswith(emitter_class.extension):
+        output_file = os.path.splitext(output_file)[0] + emitter_class.extension
+    emitter = emitter_class(output_file, wide_padding=wide_padding, flush_every=flush_every,
+                            pdf_font=pdf_font, pdf_chunk_pages=pdf_chunk_pages)
     example = str()
     sentence_number = 0
-    if file_format in ['txt', 'text']:
-        if not output_file.endswith('.txt'):
-            output_file = output_file.split('.')[0] + '.txt'
-        with open(output_file, mode='w', encoding='utf-8') as f:
-            for j in range(len(glosses)):
-                if add_sentence_numbers:
-                    sentence_number += 1
-                example = align_glosses(top_lines[j], morpheme_breakdowns[j], glosses[j], translations[j], sentence_number)
-                print(example, file=f)
-    elif file_format == 'pdf':
-        if not output_file.endswith('.pdf'):
-            output_file = output_file.split('.')[0]  + '.pdf'
-        pdf = FPDF()
-        pdf.add_page()
-        pdf.set_font("Courier", size=12)
-        line_height = 5
-        pdf.set_font("Arial", size=12)
-        for j in range(len(glosses)):
-            if pdf.get_y() + (line_height * 4) > pdf.page_break_trigger:
-                pdf.add_page()
-
+    try:
+        for top_line, morpheme_breakdown, gloss, translation in examples:
             if add_sentence_numbers:
                 sentence_number += 1
-            example = align_glosses(top_lines[j], morpheme_breakdowns[j], glosses[j], translations[j], sentence_number)
-            pdf.multi_cell(0, line_height, txt=example)
-        pdf.output(output_file)
-
+            record = {'number': sentence_number,
+                      'top_line': top_line,
+                      'morphemes': morpheme_breakdown,
+                      'gloss': gloss,
+                      'translation': translation}
+            example = emitter.write(record)
+    finally:
+        emitter.close()
     return example
 
-def apply_sound_changes(examples, cwd, sound_change_file):
-    if not sound_change_file:
-        return [e.replace('-', '') for e in examples]
+def generate_output_file(file_format, output_file, top_lines, morpheme_breakdowns, glosses, translations, add_sentence_numbers, wide_padding=False,
+                         pdf_font=None, pdf_chunk_pages=0):
+    examples = zip(top_lines, morpheme_breakdowns, glosses, translations)
+    return write_examples(file_format, output_file, examples, add_sentence_numbers, wide_padding=wide_padding,
+                          pdf_font=pdf_font, pdf_chunk_pages=pdf_chunk_pages)
+
+class LRUCache:
+    """
+    A dictionary with a maximum size, which forgets the least recently used items first.
+    It keeps count of hits and misses, so you can check that caching is worth it.
+    maxsize : the largest number of items to keep, or None for no limit
+    """
+
+    def __init__(self, maxsize=100000):
+        self.maxsize = maxsize
+        self.items = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        try:
+            value = self.items[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self.items.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        self.items[key] = value
+        self.items.move_to_end(key)
+        if self.maxsize is not None and len(self.items) > self.maxsize:
+            self.items.popitem(last=False)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'size': len(self.items),
+                'maxsize': self.maxsize}
+
+    def load(self, path):
+        """
+        Add the items saved in the file at path, if there is one
+        """
+        if not os.path.exists(path):
+            return self
+        with open(path, encoding='utf-8') as f:
+            entries = json.load(f)
+        for key, value in entries:
+            self.put(tuple(key), value)
+        return self
+
+    def save(self, path):
+        with open(path, mode='w', encoding='utf-8') as f:
+            json.dump([[list(key), value] for key, value in self.items.items()], f, ensure_ascii=False)
+
+    def clear(self):
+        self.items.clear()
+
+    def __len__(self):
+        return len(self.items)
+
+    def __contains__(self, key):
+        return key in self.items
+
+def hash_rules(lines):
+    """
+    Return a hash of the text of a list of sound change rules, used to key cached results
+    """
+    return hashlib.sha1('\n'.join(lines).encode('utf-8')).hexdigest()
+
+class SoundChanges:
+    """
+    The rules from a sound change file, compiled against a Segbase.
+    lines : the text of each rule, in order
+    segbase : a Segbase object
+    compile_cascade : if True, the rules are also compiled into a single ursus.rules.Cascade
+    """
+
+    def __init__(self, lines, segbase, compile_cascade=False):
+        self.segbase = segbase
+        self.rules = [Rule(line).compile(segbase) for line in lines]
+        self.ruleset = hash_rules(lines)
+        self.cascade = Cascade(self.rules, segbase) if compile_cascade else None
+
+    def apply(self, word):
+        if self.cascade is not None:
+            return self.cascade.apply(word)
+        for rule in self.rules:
+            word, applied = rule.apply(word, self.segbase)
+        return word
 
-    segbase = Segbase(path=resource_path(os.path.join('ursus','data','ipa2spe.txt')))
+def read_sound_change_file(cwd, sound_change_file, compile_cascade=False, segbase_backend='python', segbase=None):
+    """
+    Return a SoundChanges object for the rules in sound_change_file.
+    segbase : an already loaded Segbase to reuse, otherwise one is loaded with segbase_backend
+    """
+    if segbase is None:
+        segbase = Segbase.from_snapshot(path=resource_path(os.path.join('ursus','data','ipa2spe.txt')), backend=segbase_backend)
 
     try:
         path = os.path.join(cwd, sound_change_file)
         #path = resource_path(sound_change_file)
         with open(path, encoding='utf-8') as f:
-            rules = [Rule(line.strip()) for line in f if line.strip()]
+            lines = [line.strip() for line in f if line.strip()]
     except FileNotFoundError as e:
         print(f'You specified a sound change file called "{sound_change_file}" but GLOM could not find it. Double check the name and spelling. The file must be in the same folder as the GLOM program.')
         sys.exit()
+    return SoundChanges(lines, segbase, compile_cascade)
+
+def change_sentences(examples, sound_changes, cache=None):
+    if sound_changes is None:
+        return [e.replace('-', '') for e in examples]
 
     output = list()
     for e in examples:
@@ -278,12 +986,428 @@ def apply_sound_changes(examples, cwd, sound_change_file):
                 results.append('?')
                 continue
             word = word.replace('-','')
-            for rule in rules:
-                word, applied = rule.apply(word, segbase)
+            key = (sound_changes.ruleset, word)
+            if cache is not None:
+                result = cache.get(key)
+                if result is not None:
+                    results.append(result)
+                    continue
+            word = sound_changes.apply(word)
+            if cache is not None:
+                cache.put(key, word)
             results.append(word)
         output.append(' '.join(results))
     return output
 
+def apply_sound_changes(examples, cwd, sound_change_file, compile_cascade=False, cache=None, segbase_backend='python'):
+    if not sound_change_file:
+        return [e.replace('-', '') for e in examples]
+
+    sound_changes = read_sound_change_file(cwd, sound_change_file, compile_cascade, segbase_backend)
+    return change_sentences(examples, sound_changes, cache)
+
+#each worker process keeps its own copy of these, see init_worker
+worker_data = dict()
+
+def init_worker(lexicon, paradigms, sound_changes, cache_size, word_cache_size=0):
+    worker_data['lexicon'] = lexicon
+    worker_data['paradigms'] = paradigms
+    worker_data['sound_changes'] = sound_changes
+    worker_data['cache'] = LRUCache(cache_size) if cache_size else None
+    worker_data['word_cache'] = LRUCache(word_cache_size) if word_cache_size else None
+
+def gloss_shard(glosses):
+    morpheme_breakdowns, errors = get_morphemes(glosses, worker_data['lexicon'], worker_data['paradigms'], worker_data['word_cache'])
+    top_lines = change_sentences(morpheme_breakdowns, worker_data['sound_changes'], worker_data['cache'])
+    return morpheme_breakdowns, top_lines, errors
+
+def gloss_in_parallel(glosses, lexicon, paradigms, sound_changes, workers, cache=None, word_cache_size=0, progress=None, cancel=None):
+    """
+    Split glosses into shards and process them in a pool of worker processes.
+    The lexicon, paradigms and compiled sound changes are sent to each worker once, when it starts.
+    progress, cancel : optional hooks, checked after each shard, see construct_examples
+    Returns the morpheme breakdowns and top lines in the same order as glosses, and a list of
+    missing morphemes with duplicates removed.
+    """
+    import concurrent.futures #only needed with --workers, and slow to import
+    shard_size = max(1, -(-len(glosses) // (workers * 4)))
+    shards = [glosses[j:j+shard_size] for j in range(0, len(glosses), shard_size)]
+    cache_size = cache.maxsize if cache is not None else 0
+
+    morpheme_breakdowns = list()
+    top_lines = list()
+    errors = list()
+    seen = set()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers,
+                                                initializer=init_worker,
+                                                initargs=(lexicon, paradigms, sound_changes, cache_size, word_cache_size)) as executor:
+        for shard_morphemes, shard_top_lines, shard_errors in executor.map(gloss_shard, shards):
+            morpheme_breakdowns.extend(shard_morphemes)
+            top_lines.extend(shard_top_lines)
+            for e in shard_errors:
+                if e not in seen:
+                    seen.add(e)
+                    errors.append(e)
+            if progress is not None:
+                progress('glossing', len(morpheme_breakdowns), len(glosses))
+            if cancel is not None and cancel():
+                executor.shutdown(cancel_futures=True)
+                raise GlossingCancelled(f'Cancelled after {len(morpheme_breakdowns)} sentences')
+
+    if cache is not None and sound_changes is not None:
+        #keep the results, so they can be saved to the cache file
+        for breakdown, top_line in zip(morpheme_breakdowns, top_lines):
+            for word, result in zip(breakdown.split(), top_line.split()):
+                if word != '?':
+                    cache.put((sound_changes.ruleset, word.replace('-', '')), result)
+
+    return morpheme_breakdowns, top_lines, errors
+
+class Glosser:
+    """
+    Glosses sentences with a lexicon, paradigms and sound changes that are loaded once, so that GLOM
+    can be used from other Python programs. Glossing doesn't read or write any files, or print anything.
+    lexicon : a dictionary of gloss -> morpheme, or a LexiconIndex, see read_dictionary_files
+    paradigms : a ParadigmIndex, see compile_paradigms
+    sound_changes : a SoundChanges object, or None to just remove the hyphens for the top line
+    cache_size : number of words to remember the sound changes for, 0 for no cache
+    word_cache_size : number of glossed words to remember, 0 for no cache
+    The lexicon is never changed, missing morphemes are only reported in the records that gloss returns.
+    A ParadigmError is raised for grammatical glosses that are not in any paradigm.
+    """
+
+    def __init__(self, lexicon, paradigms, sound_changes=None, cache_size=100000, word_cache_size=100000):
+        self.lexicon = lexicon
+        self.paradigms = paradigms
+        self.sound_changes = sound_changes
+        self.cache = LRUCache(cache_size) if cache_size else None
+        self.word_cache = LRUCache(word_cache_size) if word_cache_size else None
+
+    @classmethod
+    def from_files(cls, dictionary_dir='dictionaries', paradigm_dir='paradigms', sound_change_file=None,
+                   dictionary_order='gloss', table_order='rows', compile_cascade=False, segbase_backend='python',
+                   lexicon_index=None, cwd=None, **kwargs):
+        """
+        Load the dictionary, paradigm and sound change files the same way as construct_examples.
+        File names are relative to cwd, which defaults to the current directory.
+        kwargs are passed on to Glosser
+        """
+        if cwd is None:
+            cwd = os.getcwd()
+        lexicon = read_dictionary_files(cwd, dictionary_dir, dictionary_order, lexicon_index)
+        paradigms = compile_paradigms(read_paradigm_files(cwd, paradigm_dir, table_order))
+        sound_changes = read_sound_change_file(cwd, sound_change_file, compile_cascade, segbase_backend) if sound_change_file else None
+        return cls(lexicon, paradigms, sound_changes, **kwargs)
+
+    def update(self, lexicon=None, paradigms=None, sound_changes=None):
+        """
+        Replace the lexicon, paradigms or sound changes. Remembered words are forgotten if the
+        lexicon or paradigms change. Remembered sound changes are keyed by the rules, so they stay.
+        """
+        if lexicon is not None:
+            self.lexicon = lexicon
+        if paradigms is not None:
+            self.paradigms = paradigms
+        if sound_changes is not None:
+            self.sound_changes = sound_changes
+        if self.word_cache is not None and (lexicon is not None or paradigms is not None):
+            self.word_cache.clear()
+
+    def gloss(self, gloss, translation='', number=0):
+        """
+        Gloss one sentence, like 'witness-NOM.SG.ANIM LAW-testify-PAST'.
+        Returns a record (see Emitter), with one extra key: missing, the list of morphemes
+        in this sentence that were replaced by '?'
+        """
+        words = list()
+        missing = list()
+        for word in gloss.split():
+            result = self.word_cache.get(word) if self.word_cache is not None else None
+            if result is None:
+                result = get_word_morphemes(word, self.lexicon, self.paradigms, list())
+                if self.word_cache is not None:
+                    self.word_cache.put(word, result)
+            words.append(result[0])
+            missing.extend(morpheme for morpheme in result[1] if morpheme not in missing)
+        morphemes = ' '.join(words)
+        return {'number': number,
+                'top_line': change_sentences([morphemes], self.sound_changes, self.cache)[0],
+                'morphemes': morphemes,
+                'gloss': gloss,
+                'translation': translation,
+                'missing': missing}
+
+    def gloss_many(self, sentences, add_sentence_numbers=False):
+        """
+        Gloss an iterable of sentences, which can be strings of glosses or (gloss, translation) pairs.
+        Yields one record per sentence, as soon as it is glossed.
+        If add_sentence_numbers is True, sentences are numbered from 1.
+        """
+        for j, sentence in enumerate(sentences, start=1):
+            if isinstance(sentence, str):
+                gloss, translation = sentence, ''
+            else:
+                gloss, translation = sentence
+            yield self.gloss(gloss, translation, j if add_sentence_numbers else 0)
+
+def collect_missing(records, errors):
+    """
+    Yield (top_line, morpheme_breakdown, gloss, translation) tuples for write_examples from Glosser records,
+    adding each missing morpheme to errors the first time it is seen
+    """
+    seen = set(errors)
+    for record in records:
+        for morpheme in record['missing']:
+            if morpheme not in seen:
+                seen.add(morpheme)
+                errors.append(morpheme)
+        yield record['top_line'], record['morphemes'], record['gloss'], record['translation']
+
+class GlossingCancelled(Exception):
+    """
+    Raised when the cancel hook passed to construct_examples returns True. The output file is left unfinished.
+    """
+
+def track_progress(sentences, total=None, progress=None, cancel=None, stage='glossing'):
+    """
+    Yield sentences, calling progress(stage, done, total) every total/200 sentences and at the end,
+    and checking cancel() before each sentence. Raises GlossingCancelled if cancel returns True.
+    """
+    step = max(1, total // 200) if total else 100
+    done = 0
+    for sentence in sentences:
+        if cancel is not None and cancel():
+            raise GlossingCancelled(f'Cancelled after {done} sentences')
+        yield sentence
+        done += 1
+        if progress is not None and done % step == 0:
+            progress(stage, done, total)
+    if progress is not None and done % step:
+        progress(stage, done, total)
+
+def print_progress(stage, done, total):
+    """
+    A progress hook for construct_examples that shows a counter in the console
+    """
+    total = total if total is not None else '?'
+    end = '\n' if done == total else ''
+    print(f'\r{stage}: {done}/{total}', end=end, file=sys.stderr, flush=True)
+
+def read_manifest(path):
+    """
+    Return the sentences saved in an incremental build manifest, or an empty list if there isn't one
+    """
+    try:
+        with open(path, encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return list()
+    return manifest.get('sentences', list())
+
+def write_manifest(path, records):
+    with open(path, mode='w', encoding='utf-8') as f:
+        json.dump({'version': 1, 'sentences': records}, f, ensure_ascii=False)
+
+def is_up_to_date(record, lexicon, paradigms):
+    """
+    Check that every lexicon entry and paradigm cell that a manifest record depends on
+    still has the same value
+    """
+    for gloss, morpheme in record['lexicon'].items():
+        if lexicon.get(gloss) != morpheme:
+            return False
+    for gloss, morpheme in record['paradigms'].items():
+        if paradigms.get(gloss) != morpheme:
+            return False
+    return True
+
+def gloss_incrementally(sentences, lexicon, paradigms, sound_changes, previous, cache=None):
+    """
+    Gloss (gloss, translation) pairs, reusing the results from an earlier run wherever possible.
+    previous : the records from read_manifest
+    A sentence is looked up again only if its gloss is new, or if a lexicon entry or paradigm cell
+    it used has changed. Sound changes are applied again only if its morphemes or the rules changed.
+    Returns the new records (in input order, ready for write_manifest), a list of missing morphemes,
+    and a dictionary counting how many sentences were 'reused', 'changed' (sound changes only) or 'glossed'
+    """
+    ruleset = sound_changes.ruleset if sound_changes is not None else None
+    old_records = {record['gloss']: record for record in previous}
+    records = list()
+    errors = list()
+    seen = set()
+    counts = {'reused': 0, 'changed': 0, 'glossed': 0}
+    for gloss, translation in sentences:
+        record = old_records.get(gloss)
+        if record is not None and is_up_to_date(record, lexicon, paradigms):
+            for morpheme in record['missing']:
+                lexicon, result, errors = query_lexicon(lexicon, morpheme, errors, seen)
+            if record['ruleset'] == ruleset:
+                counts['reused'] += 1
+            else:
+                record = dict(record, top_line=change_sentences([record['morphemes']], sound_changes, cache)[0], ruleset=ruleset)
+                counts['changed'] += 1
+        else:
+            dependencies = {'lexicon': dict(), 'paradigms': dict()}
+            words = list()
+            missing = list()
+            for word in gloss.split():
+                new_word, word_missing = get_word_morphemes(word, lexicon, paradigms, errors, dependencies, seen)
+                words.append(new_word)
+                missing.extend(word_missing)
+            morphemes = ' '.join(words)
+            record = {'gloss': gloss,
+                      'morphemes': morphemes,
+                      'top_line': change_sentences([morphemes], sound_changes, cache)[0],
+                      'ruleset': ruleset,
+                      'lexicon': dependencies['lexicon'],
+                      'paradigms': dependencies['paradigms'],
+                      'missing': missing}
+            old_records[gloss] = record
+            counts['glossed'] += 1
+        records.append(dict(record, translation=translation))
+    return records, errors, counts
+
+def gloss_examples(cwd, input_file, output_file, glosser,
+                   file_format='text', input_order='translation', add_sentence_numbers=False,
+                   workers=1, stream=False, incremental=False,
+                   wide_padding=False, pdf_font=None, pdf_chunk_pages=0, progress=None, cancel=None):
+    """
+    Gloss every sentence in input_file with a Glosser, and write the results to output_file.
+    See construct_examples for the other arguments.
+    Returns the list of missing morphemes, and the last example that was written
+    """
+    total = None
+    if progress is not None:
+        #a quick pass over the input file, so that progress can be reported out of the total
+        total = sum(1 for sentence in iter_input_file(cwd, input_file, input_order))
+    if incremental:
+        #only gloss sentences that changed since the last run, see gloss_incrementally
+        manifest_file = output_file + '.manifest.json'
+        sentences = track_progress(iter_input_file(cwd, input_file, input_order), total, progress, cancel)
+        records, errors, counts = gloss_incrementally(sentences, glosser.lexicon, glosser.paradigms, glosser.sound_changes,
+                                                      read_manifest(manifest_file), glosser.cache)
+        examples = ((r['top_line'], r['morphemes'], r['gloss'], r['translation']) for r in records)
+        example_sentence = write_examples(file_format, output_file, examples, add_sentence_numbers, wide_padding=wide_padding,
+                                          pdf_font=pdf_font, pdf_chunk_pages=pdf_chunk_pages)
+        write_manifest(manifest_file, records)
+        print(f'Glossed {counts["glossed"]} sentences, updated sound changes in {counts["changed"]}, and reused {counts["reused"]} earlier results.')
+    elif workers > 1 and not stream:
+        glosses, morphemes = read_input_file(cwd, input_file, input_order)
+        word_cache_size = glosser.word_cache.maxsize if glosser.word_cache is not None else 0
+        morpheme_breakdowns, top_lines, errors = gloss_in_parallel(glosses, glosser.lexicon, glosser.paradigms, glosser.sound_changes,
+                                                                   workers, glosser.cache, word_cache_size, progress, cancel)
+        example_sentence = generate_output_file(file_format, output_file, top_lines, morpheme_breakdowns, glosses, morphemes, add_sentence_numbers, wide_padding,
+                                                pdf_font, pdf_chunk_pages)
+    else:
+        #one sentence at a time, from the input file all the way to the output file
+        errors = list()
+        sentences = track_progress(iter_input_file(cwd, input_file, input_order), total, progress, cancel)
+        examples = collect_missing(glosser.gloss_many(sentences), errors)
+        example_sentence = write_examples(file_format, output_file, examples, add_sentence_numbers, wide_padding=wide_padding,
+                                          pdf_font=pdf_font, pdf_chunk_pages=pdf_chunk_pages)
+    return errors, example_sentence
+
+def file_mtimes(cwd, path):
+    """
+    Return a dictionary of modification times for path, or for every file in path if it is a directory.
+    Files that don't exist are left out.
+    """
+    path = os.path.join(cwd, path)
+    if os.path.isdir(path):
+        files = [os.path.join(path, file) for file in sorted(os.listdir(path))]
+    else:
+        files = [path]
+    mtimes = dict()
+    for file in files:
+        try:
+            mtimes[file] = os.stat(file).st_mtime_ns
+        except FileNotFoundError:
+            pass
+    return mtimes
+
+def watched_mtimes(cwd, input_file, dictionary_dir, paradigm_dir, sound_change_file):
+    """
+    Return the modification times of every file that GLOM reads, grouped by the resource they belong to
+    """
+    mtimes = {'input': file_mtimes(cwd, input_file),
+              'dictionaries': file_mtimes(cwd, dictionary_dir),
+              'paradigms': file_mtimes(cwd, paradigm_dir)}
+    if sound_change_file:
+        mtimes['sound_changes'] = file_mtimes(cwd, sound_change_file)
+    return mtimes
+
+class PreviewGlosser:
+    """
+    Keeps a Glosser loaded between previews, for showing a few glossed sentences while options are changed.
+    Before each preview the modification times of the dictionary, paradigm and sound change files are
+    checked, and only the resources whose files or settings changed are read again. The first sentences of
+    the input file are remembered too, until the file changes. A ParadigmError is raised like in Glosser.
+    """
+
+    def __init__(self, cwd=None, compile_cascade=False, cache_size=100000, word_cache_size=100000):
+        self.cwd = cwd if cwd is not None else os.getcwd()
+        self.compile_cascade = compile_cascade
+        self.cache_size = cache_size
+        self.word_cache_size = word_cache_size
+        self.glosser = None
+        self.sources = dict() #resource -> (settings, mtimes) that it was loaded from
+        self.input_key = None
+        self.sentences = list()
+
+    def load(self, dictionary_dir='dictionaries', paradigm_dir='paradigms', sound_change_file=None,
+             dictionary_order='gloss', table_order='rows'):
+        """
+        Bring the Glosser up to date with these files and settings.
+        Returns the list of resources that were read again, which is empty if nothing changed
+        """
+        cwd = self.cwd
+        sources = {'dictionaries': ((dictionary_dir, dictionary_order), file_mtimes(cwd, dictionary_dir)),
+                   'paradigms': ((paradigm_dir, table_order), file_mtimes(cwd, paradigm_dir)),
+                   'sound_changes': (sound_change_file, file_mtimes(cwd, sound_change_file) if sound_change_file else None)}
+        changed = [name for name in sources if self.sources.get(name) != sources[name]]
+        if not changed:
+            return changed
+        lexicon = paradigms = None
+        if 'dictionaries' in changed:
+            lexicon = read_dictionary_files(cwd, dictionary_dir, dictionary_order)
+        if 'paradigms' in changed:
+            paradigms = compile_paradigms(read_paradigm_files(cwd, paradigm_dir, table_order))
+        if self.glosser is None:
+            self.glosser = Glosser(lexicon, paradigms, None, self.cache_size, self.word_cache_size)
+        else:
+            self.glosser.update(lexicon=lexicon, paradigms=paradigms)
+        if 'sound_changes' in changed:
+            sound_changes = self.glosser.sound_changes
+            if not sound_change_file:
+                sound_changes = None
+            else:
+                #the Segbase never changes, so it is only loaded once
+                segbase = sound_changes.segbase if sound_changes is not None else None
+                sound_changes = read_sound_change_file(cwd, sound_change_file, self.compile_cascade, segbase=segbase)
+            self.glosser.sound_changes = sound_changes
+        self.sources = sources
+        return changed
+
+    def first_sentences(self, input_file, input_order='translation', limit=10):
+        """
+        Return the first limit (gloss, translation) pairs from input_file
+        """
+        key = (input_file, input_order, limit, file_mtimes(self.cwd, input_file))
+        if key != self.input_key:
+            self.sentences = list(itertools.islice(iter_input_file(self.cwd, input_file, input_order), limit))
+            self.input_key = key
+        return self.sentences
+
+    def preview(self, sentences, add_sentence_numbers=False, wide_padding=False):
+        """
+        Gloss (gloss, translation) pairs with the loaded Glosser, and return them as aligned text
+        """
+        writer = InterlinearWriter(io.StringIO(), wide_padding)
+        examples = list()
+        for record in self.glosser.gloss_many(sentences, add_sentence_numbers):
+            examples.append(writer.write(record['top_line'], record['morphemes'], record['gloss'], record['translation'], record['number']))
+        return '\n\n\n'.join(examples)
+
 def construct_examples(input_file,
                       output_file,
                       dictionary_dir='dictionaries',
@@ -294,14 +1418,51 @@ def construct_examples(input_file,
                       dictionary_order = 'gloss',
                       sound_change_file=None,
                       print_one=False,
-                      table_order='rows'):
+                      table_order='rows',
+                      compile_cascade=False,
+                      cache_size=100000,
+                      cache_file=None,
+                      workers=1,
+                      stream=False,
+                      segbase_backend='python',
+                      lexicon_index=None,
+                      word_cache_size=100000,
+                      incremental=False,
+                      watch=False,
+                      poll_interval=0.5,
+                      wide_padding=False,
+                      pdf_font=None,
+                      pdf_chunk_pages=0,
+                      progress=None,
+                      cancel=None):
+    """
+    Gloss every sentence in input_file and write them to output_file, see the command line help for the arguments.
+    progress : optional function that is called as progress(stage, done, total) while GLOM works, where stage
+    is 'loading' or 'glossing', and done and total count files or sentences. See print_progress.
+    cancel : optional function that is checked between sentences. If it returns True, GlossingCancelled is raised.
+    Returns the list of missing morphemes
+    """
     cwd = os.getcwd()
-    lexicon = read_dictionary_files(cwd, dictionary_dir, dictionary_order)
-    paradigms = read_paradigm_files(cwd, paradigm_dir, table_order)
-    glosses, morphemes = read_input_file(cwd, input_file, input_order)
-    morpheme_breakdowns, errors = get_morphemes(glosses, lexicon, paradigms)
-    top_lines = apply_sound_changes(morpheme_breakdowns, cwd, sound_change_file)
-    example_sentence = generate_output_file(file_format, output_file, top_lines, morpheme_breakdowns, glosses, morphemes, add_sentence_numbers)
+    if watch:
+        #checked before loading anything, so that an edit made while GLOM starts up isn't missed
+        mtimes = watched_mtimes(cwd, input_file, dictionary_dir, paradigm_dir, sound_change_file)
+    if progress is not None:
+        progress('loading', 0, 1)
+    glosser = Glosser.from_files(dictionary_dir, paradigm_dir, sound_change_file, dictionary_order, table_order,
+                                 compile_cascade, segbase_backend, lexicon_index, cwd,
+                                 cache_size=cache_size, word_cache_size=word_cache_size)
+    if progress is not None:
+        progress('loading', 1, 1)
+    if glosser.cache is not None and cache_file:
+        glosser.cache.load(os.path.join(cwd, cache_file))
+    try:
+        errors, example_sentence = gloss_examples(cwd, input_file, output_file, glosser, file_format, input_order, add_sentence_numbers,
+                                                  workers, stream, incremental, wide_padding, pdf_font, pdf_chunk_pages, progress, cancel)
+    except ParadigmError as e:
+        report_paradigm_error(e)
+        sys.exit()
+    if glosser.cache is not None and cache_file and sound_change_file:
+        glosser.cache.save(os.path.join(cwd, cache_file))
 
     if len(errors)>0:
         print(f'WARNING: The following {len(errors)} items in your input file could not be located in any dictionary or paradigm:\n')
@@ -318,6 +1479,58 @@ def construct_examples(input_file,
         print('Here is the last sentence from your input file:\n ')
         print(example_sentence)
 
+    if watch:
+        #keep everything loaded, and only reload the resources whose files changed
+        print(f'\nWatching for changes every {poll_interval} seconds. Press Ctrl+C to stop.')
+        last_problem = None
+        try:
+            while True:
+                time.sleep(poll_interval)
+                new_mtimes = watched_mtimes(cwd, input_file, dictionary_dir, paradigm_dir, sound_change_file)
+                changed = [name for name in new_mtimes if new_mtimes[name] != mtimes[name]]
+                if not changed:
+                    continue
+                start = time.perf_counter()
+                if not new_mtimes['input'] or (sound_change_file and not new_mtimes['sound_changes']):
+                    #the file is being replaced, wait for it to come back
+                    problem = 'a file is missing'
+                    if problem != last_problem:
+                        print(f'Could not rebuild "{output_file}" after changes to {", ".join(changed)} ({problem}). Trying again until the files can be read.')
+                        last_problem = problem
+                    continue
+                try:
+                    if 'dictionaries' in changed:
+                        glosser.update(lexicon=read_dictionary_files(cwd, dictionary_dir, dictionary_order, lexicon_index))
+                    if 'paradigms' in changed:
+                        glosser.update(paradigms=compile_paradigms(read_paradigm_files(cwd, paradigm_dir, table_order)))
+                    if 'sound_changes' in changed:
+                        #the Segbase never changes, so it is reused for the new rules
+                        glosser.update(sound_changes=read_sound_change_file(cwd, sound_change_file, compile_cascade, segbase=glosser.sound_changes.segbase))
+                    errors, example_sentence = gloss_examples(cwd, input_file, output_file, glosser, file_format, input_order, add_sentence_numbers,
+                                                              workers, stream, incremental, wide_padding, pdf_font, pdf_chunk_pages, progress, cancel)
+                except ParadigmError as e:
+                    #a mistake in the files themselves, wait until they are edited again
+                    mtimes = new_mtimes
+                    report_paradigm_error(e)
+                    continue
+                except (OSError, ValueError, IndexError, SystemExit) as e:
+                    #many editors empty a file or replace it while saving, so keep the old modification
+                    #times and try again on the next check, but only report the same problem once
+                    problem = repr(e) if not isinstance(e, SystemExit) else 'see the message above'
+                    if problem != last_problem:
+                        print(f'Could not rebuild "{output_file}" after changes to {", ".join(changed)} ({problem}). Trying again until the files can be read.')
+                        last_problem = problem
+                    continue
+                mtimes = new_mtimes
+                last_problem = None
+                milliseconds = (time.perf_counter() - start) * 1000
+                print(f'Rebuilt "{output_file}" in {milliseconds:.0f}ms after changes to: {", ".join(changed)}')
+                if len(errors)>0:
+                    print(f'WARNING: {len(errors)} items could not be located in any dictionary or paradigm: {",".join(sorted([str(e) for e in errors]))}')
+        except KeyboardInterrupt:
+            if glosser.cache is not None and cache_file and sound_change_file:
+                glosser.cache.save(os.path.join(cwd, cache_file))
+
     return errors
 
 
@@ -328,13 +1541,30 @@ if __name__ == '__main__':
         parser.add_argument('-o', '--output_file', dest='output_file', default='new_sentences.txt', help='(Required) Name of file for writing output (glossed sentences)', required=True)
         parser.add_argument('-d', '--dictionary_dir', dest='dictionary_dir', default='dictionaries', help='(Optional) Name of local directory containing dictionary files.', required=False)
         parser.add_argument('-p', '--paradigm_dir', dest='paradigm_dir', default='paradigms', help='(Optional) Name of local directory containing paradigm files', required=False)
-        parser.add_argument('-f', '--file_format', dest='file_format', default='text', required=False, help='(Optional) Choose format for the output file, options are text or pdf, defaults to text')
+        parser.add_argument('-f', '--file_format', dest='file_format', default='text', required=False, help='(Optional) Choose format for the output file, options are text, pdf, jsonl, tsv, gb4e (or latex) and expex, defaults to text')
         parser.add_argument('-n', '--numbered_examples', dest='add_sentence_numbers', default=False, action='store_true', required=False, help='(Optional) Use this flag to add a number to each output sentence')
         parser.add_argument('-io', '--input_order', dest='input_order', default='translation', required=False, help='(Optional) Input files are ordered translation-first by default. Set this argument to "gloss" if you want the revered order')
         parser.add_argument('-do', '--dictionary-order', dest='dictionary_order', default='gloss', required=False, help='(Optional) Dictionary files are ordered gloss-first by default. Set this argument to "morpheme" if you want the reversed order')
         parser.add_argument('-sc', '--sound_changes', dest='sound_change_file', default=False, required=False, help='(Optional) Name of local file containing sound change rules. See GLOM documentation for more details.')
         parser.add_argument('-p1', '--print_one', dest='print_one', default=False, action='store_true', required=False, help='(Optional) include this flag if you want to see one example sentence printed in the console when GLOM is done.')
         parser.add_argument('-to', '--table_order', dest='table_order', default='row', required=False, help='(Optional) Paradigm tables are read in the order of rows then columns. Set this argument to "columns" if you want the reversed order')
-        args = parser.parse_args()
-        construct_examples(**vars(args))
+        parser.add_argument('-cc', '--compile_cascade', dest='compile_cascade', default=False, action='store_true', required=False, help='(Optional) include this flag to compile all of the sound change rules together so that each word is rewritten in a few passes. Useful for long sound change files and large inputs.')
+        parser.add_argument('-cs', '--cache_size', dest='cache_size', default=100000, type=int, required=False, help='(Optional) Number of words to remember the sound changes for, so repeated words are only changed once. Set to 0 to turn off the cache. Defaults to 100000')
+        parser.add_argument('-cf', '--cache_file', dest='cache_file', default=None, required=False, help='(Optional) Name of a local file where GLOM saves remembered sound changes between runs.')
+        parser.add_argument('-w', '--workers', dest='workers', default=1, type=int, required=False, help='(Optional) Number of processes to use for glossing. Useful for very large input files. Defaults to 1')
+        parser.add_argument('-s', '--stream', dest='stream', default=False, action='store_true', required=False, help='(Optional) include this flag to read, gloss and write one sentence at a time. Use this for input files that are too big to fit in memory. Ignores --workers.')
+        parser.add_argument('-sb', '--segbase_backend', dest='segbase_backend', default='python', required=False, help='(Optional) Set this to "numpy" to store phonological features in a numpy array, which makes feature-changing sound rules much faster. Requires numpy.')
+        parser.add_argument('-li', '--lexicon_index', dest='lexicon_index', default=None, required=False, help='(Optional) Name of a local file where GLOM keeps an index of your dictionaries. Only dictionary files that changed since the last run are read again. Useful for very large dictionaries.')
+        parser.add_argument('-wc', '--word_cache_size', dest='word_cache_size', default=100000, type=int, required=False, help='(Optional) Number of glossed words to remember, so repeated words are only looked up once. Set to 0 to turn this off. Defaults to 100000')
+        parser.add_argument('-inc', '--incremental', dest='incremental', default=False, action='store_true', required=False, help='(Optional) include this flag to save a manifest next to the output file, and on later runs only gloss the sentences affected by changes to the input, dictionaries, paradigms or sound changes. Ignores --workers and --stream.')
+        parser.add_argument('-wa', '--watch', dest='watch', default=False, action='store_true', required=False, help='(Optional) include this flag to keep GLOM running after the output file is written. GLOM checks the input, dictionary, paradigm and sound change files for changes, reloads only the ones that changed, and writes the output file again.')
+        parser.add_argument('-pi', '--poll_interval', dest='poll_interval', default=0.5, type=float, required=False, help='(Optional) Number of seconds between checks for changed files in --watch mode. Defaults to 0.5')
+        parser.add_argument('-wp', '--wide_padding', dest='wide_padding', default=False, action='store_true', required=False, help='(Optional) include this flag to line up text output by how wide each character is on screen, instead of counting characters. Use this if your morphemes contain Chinese, Japanese or Korean characters, or combining diacritics.')
+        parser.add_argument('-pf', '--pdf_font', dest='pdf_font', default=None, required=False, help='(Optional) Path to a TrueType (.ttf) font for PDF output. GLOM looks for DejaVu Sans Mono and a few other fonts with IPA characters by default, and falls back to Courier, which cannot show most IPA.')
+        parser.add_argument('-pc', '--pdf_chunk_pages', dest='pdf_chunk_pages', default=0, type=int, required=False, help='(Optional) Write PDF output in parts of this many pages, to keep memory use low for very large inputs. The parts are merged into one file if the pypdf package is installed.')
+        parser.add_argument('-pr', '--progress', dest='show_progress', default=False, action='store_true', required=False, help='(Optional) include this flag to show how many sentences have been glossed while GLOM works.')
+        args = vars(parser.parse_args())
+        if args.pop('show_progress'):
+            args['progress'] = print_progress
+        construct_examples(**args)
 
@@ -3,6 +3,9 @@ from tkinter import filedialog, messagebox, ttk
 import glom
 import os
 import sys
+import time
+import queue
+import threading
 
 class ToolTip:
     def __init__(self, widget, text):
@@ -68,9 +71,18 @@ def run_app():
             messagebox.showerror("File Not Found", f"The sound change file you specified cannot be found. Double-check the spelling and make sure it is in the same folder as GLOM.")
             return
 
-    loading = ttk.Progressbar(app, orient=tk.HORIZONTAL, length=300, mode='indeterminate')
-    loading.grid(row=10, column=0, columnspan=3, pady=10)
-    loading.start()
+    #glossing runs in a background thread, so the window stays responsive. The worker only puts messages
+    #on this queue, and the main thread reads them in check_messages, because Tk must only be used from one thread
+    messages = queue.Queue()
+    cancel_event.clear()
+    run_button.config(state=tk.DISABLED)
+    cancel_button.config(state=tk.NORMAL)
+    progress_bar.config(value=0, maximum=1)
+    progress_bar.grid()
+    status_var.set('Loading dictionaries and paradigms...')
+
+    def report_progress(stage, done, total):
+        messages.put(('progress', stage, done, total))
 
     def run_main():
         try:
@@ -83,22 +95,153 @@ def run_app():
                                input_order=input_order,
                                dictionary_order=dictionary_order,
                                sound_change_file=sound_changes,
-                               table_order=table_order)
-            message = f"Done! You can check the file {output_file} for your sentences"
-            if missing_data:
-                error_message = f'WARNING: The following {len(missing_data)} items in your input file could not be located in any dictionary or paradigm:\n'
-                error_message += ','.join(sorted([str(m) for m in missing_data]))
-                error_message += f'\nThese have been replaced by \'?\' in the output file.'
+                               table_order=table_order,
+                               progress=report_progress,
+                               cancel=cancel_event.is_set)
+            messages.put(('done', missing_data))
+        except glom.GlossingCancelled:
+            messages.put(('cancelled',))
+        except SystemExit:
+            #glom exits after printing problems with the input files
+            messages.put(('error', 'GLOM stopped because of a problem with your files. Check the console for details.'))
+        except Exception as e:
+            messages.put(('error', f"An error occurred: {e}"))
+
+    def check_messages():
+        while True:
+            try:
+                message = messages.get_nowait()
+            except queue.Empty:
+                break
+            if message[0] == 'progress':
+                stage, done, total = message[1:]
+                if total:
+                    progress_bar.config(maximum=total, value=done)
+                if stage == 'glossing':
+                    status_var.set(f'Glossed {done} of {total} sentences')
+                continue
+            finish_run()
+            if message[0] == 'done':
+                missing_data = message[1]
+                message = f"Done! You can check the file {output_file} for your sentences"
+                if missing_data:
+                    error_message = f'WARNING: The following {len(missing_data)} items in your input file could not be located in any dictionary or paradigm:\n'
+                    error_message += ','.join(sorted([str(m) for m in missing_data]))
+                    error_message += f'\nThese have been replaced by \'?\' in the output file.'
+                else:
+                    error_message = ''
+                messagebox.showinfo("Info", '\n'.join([message, error_message]))
+            elif message[0] == 'cancelled':
+                messagebox.showinfo("Info", f"Cancelled. The file {output_file} is incomplete.")
             else:
-                error_message = ''
-            messagebox.showinfo("Info", '\n'.join([message, error_message]))
+                messagebox.showerror("Error", message[1])
+            return
+        app.after(50, check_messages)
+
+    threading.Thread(target=run_main, daemon=True).start()
+    app.after(50, check_messages)
+
+def finish_run():
+    progress_bar.grid_remove()
+    status_var.set('')
+    run_button.config(state=tk.NORMAL)
+    cancel_button.config(state=tk.DISABLED)
+
+def cancel_run():
+    cancel_event.set()
+    status_var.set('Cancelling...')
+
+
+
+#the preview is glossed in one long-lived thread that owns the PreviewGlosser, so that dictionaries are
+#only read when they change, and loading large ones doesn't freeze the window
+preview_requests = queue.Queue()
+preview_results = queue.Queue()
+preview_glosser = glom.PreviewGlosser()
+
+def preview_settings():
+    return {'input_file': input_file_entry.get(),
+            'sentence': preview_sentence_entry.get().strip(),
+            'limit': preview_count_var.get(),
+            'sound_change_file': sound_changes_entry.get() or None,
+            'dictionary_dir': dictionary_dir_entry.get(),
+            'paradigm_dir': paradigm_dir_entry.get(),
+            'add_sentence_numbers': numbered_examples_var.get(),
+            'dictionary_order': dictionary_order_var.get().split(' ')[0].lower(),
+            'table_order': table_order_var.get().split(' ')[0].lower(),
+            'input_order': input_order_var.get().split(' ')[0].lower()}
+
+def make_preview(settings):
+    """
+    Runs in the preview thread, returns the preview text and a status message
+    """
+    cwd = os.getcwd()
+    if not settings['sentence'] and not os.path.isfile(os.path.join(cwd, settings['input_file'])):
+        return '', 'Choose an input file, or type a sentence above, to see a preview.'
+    if settings['sound_change_file'] and not os.path.isfile(os.path.join(cwd, settings['sound_change_file'])):
+        return '', 'The sound change file cannot be found.'
+    start = time.perf_counter()
+    reloaded = preview_glosser.load(settings['dictionary_dir'], settings['paradigm_dir'], settings['sound_change_file'],
+                                    settings['dictionary_order'], settings['table_order'])
+    if settings['sentence']:
+        sentences = [(settings['sentence'], '')]
+    else:
+        sentences = preview_glosser.first_sentences(settings['input_file'], settings['input_order'], settings['limit'])
+    text = preview_glosser.preview(sentences, settings['add_sentence_numbers'])
+    milliseconds = (time.perf_counter() - start) * 1000
+    status = f'Previewed {len(sentences)} sentence{"" if len(sentences) == 1 else "s"} in {milliseconds:.0f}ms'
+    if reloaded:
+        status += f' (read {", ".join(reloaded).replace("_", " ")})'
+    return text, status
+
+def preview_worker():
+    while True:
+        settings = preview_requests.get()
+        while not preview_requests.empty():
+            settings = preview_requests.get() #only the newest settings matter
+        try:
+            result = make_preview(settings)
+        except glom.ParadigmError as e:
+            result = '', f'{e.gloss} could not be found in any paradigm.' + (f' The closest match was {e.closest}.' if e.closest else '')
+        except SystemExit:
+            #glom exits after printing problems with the input files
+            result = '', 'GLOM could not read your files. Check the console for details.'
         except Exception as e:
-            messagebox.showerror("Error", f"An error occurred: {e}")
-        finally:
-            loading.stop()
-            loading.grid_forget()
-
-    app.after(100, run_main)
+            result = '', f'An error occurred: {e}'
+        preview_results.put(result)
+
+pending_preview = None
+
+def schedule_preview(*args):
+    """
+    Ask for a new preview shortly after the last change, so that typing doesn't start one for every key
+    """
+    global pending_preview
+    if pending_preview is not None:
+        app.after_cancel(pending_preview)
+    pending_preview = app.after(150, request_preview)
+
+def request_preview():
+    global pending_preview
+    pending_preview = None
+    try:
+        settings = preview_settings()
+    except tk.TclError:
+        return #the number of sentences is being typed
+    preview_requests.put(settings)
+
+def show_preview():
+    result = None
+    while not preview_results.empty():
+        result = preview_results.get()
+    if result is not None:
+        text, status = result
+        preview_text.config(state=tk.NORMAL)
+        preview_text.delete('1.0', tk.END)
+        preview_text.insert('1.0', text)
+        preview_text.config(state=tk.DISABLED)
+        preview_status_var.set(status)
+    app.after(50, show_preview)
 
 
 
@@ -107,12 +250,14 @@ def browse_file(entry):
     if filename:
         entry.delete(0, tk.END)
         entry.insert(0, os.path.basename(filename))
+        schedule_preview()
 
 def browse_directory(entry):
     directory = filedialog.askdirectory()
     if directory:
         entry.delete(0, tk.END)
         entry.insert(0, os.path.basename(directory))
+        schedule_preview()
 
 app = tk.Tk()
 app.title("GLOM - a glossing tool from ReadingGlosses.com")
@@ -203,8 +348,48 @@ table_order_var = tk.StringVar(value="Rows first")
 tk.OptionMenu(app, table_order_var, "Rows first", "Columns first").grid(row=row, column=1, padx=5, pady=5, sticky=tk.W)
 ToolTip(table_order_label, "Choose the order that GLOM should read your paradigm tables")
 
-# Run Button
+# Run and Cancel Buttons
+row +=1
+run_button = tk.Button(app, text="Generate glossed sentences!", command=run_app)
+run_button.grid(row=row, column=0, pady=10)
+cancel_event = threading.Event()
+cancel_button = tk.Button(app, text="Cancel", command=cancel_run, state=tk.DISABLED)
+cancel_button.grid(row=row, column=1, pady=10, sticky=tk.W)
+
+# Progress
+row +=1
+progress_bar = ttk.Progressbar(app, orient=tk.HORIZONTAL, length=300, mode='determinate')
+progress_bar.grid(row=row, column=0, columnspan=3, pady=(10, 0))
+progress_bar.grid_remove()
+row +=1
+status_var = tk.StringVar()
+tk.Label(app, textvariable=status_var).grid(row=row, column=0, columnspan=3, pady=(0, 10))
+
+# Preview
 row +=1
-tk.Button(app, text="Generate glossed sentences!", command=run_app).grid(row=row, column=0, pady=10)
+preview_frame = tk.LabelFrame(app, text="Preview")
+preview_frame.grid(row=row, column=0, columnspan=3, padx=5, pady=5, sticky=tk.W+tk.E)
+preview_count_label = tk.Label(preview_frame, text="Sentences to preview:")
+preview_count_label.grid(row=0, column=0, sticky=tk.W)
+preview_count_var = tk.IntVar(value=5)
+tk.Spinbox(preview_frame, from_=1, to=100, width=5, textvariable=preview_count_var).grid(row=0, column=1, padx=5, pady=5, sticky=tk.W)
+ToolTip(preview_count_label, "How many sentences from the start of the input file to show in the preview")
+preview_sentence_label = tk.Label(preview_frame, text="Try a sentence:")
+preview_sentence_label.grid(row=1, column=0, sticky=tk.W)
+preview_sentence_entry = tk.Entry(preview_frame, width=50)
+preview_sentence_entry.grid(row=1, column=1, padx=5, pady=5, sticky=tk.W)
+ToolTip(preview_sentence_label, "Type a glossed sentence, like witness-NOM.SG.ANIM, to preview it instead of the input file")
+preview_text = tk.Text(preview_frame, width=80, height=15, font="TkFixedFont", wrap=tk.NONE, state=tk.DISABLED)
+preview_text.grid(row=2, column=0, columnspan=2, padx=5, pady=5)
+preview_status_var = tk.StringVar()
+tk.Label(preview_frame, textvariable=preview_status_var).grid(row=3, column=0, columnspan=2, sticky=tk.W)
+
+for var in (preview_count_var, numbered_examples_var, input_order_var, dictionary_order_var, table_order_var):
+    var.trace_add('write', schedule_preview)
+for entry in (input_file_entry, sound_changes_entry, dictionary_dir_entry, paradigm_dir_entry, preview_sentence_entry):
+    entry.bind('<KeyRelease>', schedule_preview)
+threading.Thread(target=preview_worker, daemon=True).start()
+app.after(50, show_preview)
+schedule_preview()
 
 app.mainloop()
@@ -0,0 +1,5 @@
+import os
+import sys
+
+#the tests import glom and ursus from the root of the repository, like glom.py does
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,103 @@
+"""
+Cascade.apply has to give the same output as running the rules one at a time with Rule.apply,
+whether or not the rules are compiled.
+"""
+
+import os
+import random
+import pytest
+from ursus.rules import Rule, Cascade
+from ursus.segbase import Segbase
+
+ALPHABET = 'ptkbdgmnszfvxhlrjwaeiouyəɛɔ'
+SEGMENTS = ['p', 't', 'k', 'b', 'd', 'm', 's', 'x', 'a', 'e', 'i', 'o', 'u', 'ə', '{p,t}', '{a,o}']
+BUNDLES = ['[+voc]', '[-voc]', '[-voice,+cons]', '[+nasal]', '[-back,+voc,-cons]', '[+cont]', '[+voice]']
+FEATURE_CHANGES = ['+voice', '-voice', '+nasal', '-cont', '+round,+back', '+high']
+CONTEXTS = ['', '', '#', 'a', 'x', '{t,k}', '[+voc]', '[-voc]', '[+nasal]', '[-cons,+voc]']
+
+
+class FirstChoice:
+    """
+    Breaks ties in Segbase.choose_symbol_from_features the same way every time, no matter
+    how often or in which order it is called
+    """
+
+    def choice(self, options):
+        return min(options)
+
+
+@pytest.fixture(scope='module')
+def pbase():
+    pbase = Segbase(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'ursus', 'data', 'ipa2spe.txt'))
+    pbase.rng = FirstChoice()
+    return pbase
+
+
+def random_rule(rng):
+    kind = rng.choice(['segment', 'segment', 'bundle', 'feature', 'insertion', 'deletion'] * 3 + ['placeholder'])
+    c, d = rng.choice(CONTEXTS), rng.choice(CONTEXTS)
+    if rng.random() < 0.4:
+        c = d = '' #context-free rules are composed into translation tables by Cascade
+    if kind == 'insertion':
+        a, b = rng.choice(['@', 'Ø']), rng.choice(['j', 'ə', 'h'])
+    elif kind == 'deletion':
+        a, b = rng.choice(SEGMENTS + BUNDLES), rng.choice(['@', 'Ø'])
+    elif kind == 'placeholder':
+        a, b = rng.choice(SEGMENTS), '?'
+    elif kind == 'feature':
+        a, b = rng.choice(BUNDLES + SEGMENTS), rng.choice(FEATURE_CHANGES)
+    else:
+        a, b = rng.choice(SEGMENTS + BUNDLES), rng.choice(['p', 'h', 'ʃ', 'px', 'e', 'i'])
+    return f'{a} -> {b} / {c}_{d}'
+
+
+def random_word(rng, symbols=ALPHABET):
+    return ''.join(rng.choice(symbols) for _ in range(rng.randint(1, 8)))
+
+
+def apply_one_at_a_time(rules, word, pbase):
+    for rule in rules:
+        word, applied = rule.apply(word, pbase)
+    return word
+
+
+@pytest.mark.parametrize('seed', range(100))
+def test_cascade_matches_rules(pbase, seed):
+    rng = random.Random(seed)
+    texts = [random_rule(rng) for _ in range(rng.randint(1, 8))]
+    uncompiled = [Rule(text) for text in texts]
+    compiled = [Rule(text).compile(pbase) for text in texts]
+    cascade = Cascade([Rule(text) for text in texts], pbase)
+    for _ in range(120):
+        word = random_word(rng, ALPHABET + '?')
+        expected = apply_one_at_a_time(compiled, word, pbase)
+        assert cascade.apply(word) == expected, (texts, word)
+        try:
+            slow = apply_one_at_a_time(uncompiled, word, pbase)
+        except KeyError:
+            #a feature bundle was checked against a symbol that isn't in the Segbase, which
+            #only uncompiled rules look up (compiled rules just don't match it)
+            continue
+        assert slow == expected, (texts, word)
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_cascade_matches_rules_with_placeholders(pbase, seed):
+    #words with '@' or 'Ø' in them go through the rules one by one
+    rng = random.Random(seed)
+    texts = [random_rule(rng) for _ in range(rng.randint(1, 8))]
+    compiled = [Rule(text).compile(pbase) for text in texts]
+    cascade = Cascade([Rule(text) for text in texts], pbase)
+    for _ in range(60):
+        word = random_word(rng, ALPHABET + '@Ø?')
+        assert cascade.apply(word) == apply_one_at_a_time(compiled, word, pbase), (texts, word)
+
+
+def test_tirilian_sound_changes(pbase):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    with open(os.path.join(root, 'tirilian_sound_changes.txt'), encoding='utf-8') as f:
+        texts = [line.strip() for line in f if line.strip()]
+    cascade = Cascade([Rule(text) for text in texts], pbase)
+    for word in ['taw-e', 'pan-tep', 'jaxt-te-tep', 'ixe-hal-et', 'ite-a', 'sxat', 'titta']:
+        word = word.replace('-', '')
+        assert cascade.apply(word) == apply_one_at_a_time([Rule(text) for text in texts], word, pbase)
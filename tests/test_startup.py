@@ -0,0 +1,27 @@
+"""
+GLOM is started thousands of times by batch jobs, so importing it has to stay fast.
+The budget can be changed with the GLOM_IMPORT_BUDGET_MS environment variable, for slow machines.
+"""
+
+import os
+import sys
+import json
+import subprocess
+from benchmark import measure_import_time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+IMPORT_BUDGET_MS = float(os.environ.get('GLOM_IMPORT_BUDGET_MS', 150))
+
+
+def test_import_glom_is_under_budget():
+    milliseconds = measure_import_time('glom', repeat=5) * 1000
+    assert milliseconds < IMPORT_BUDGET_MS, f'import glom took {milliseconds:.1f}ms, the budget is {IMPORT_BUDGET_MS:.0f}ms'
+
+
+def test_import_glom_skips_optional_modules():
+    #these are only needed for PDF output, the numpy Segbase backend and --workers
+    code = 'import sys, json, glom; print(json.dumps(sorted(sys.modules)))'
+    result = subprocess.run([sys.executable, '-c', code], check=True, capture_output=True, text=True, cwd=ROOT)
+    modules = set(json.loads(result.stdout))
+    for module in ['fpdf', 'numpy', 'concurrent.futures', 'pip']:
+        assert module not in modules, f'import glom also imported {module}'
@@ -1,10 +1,19 @@
-from flask import Flask, render_template, request, jsonify, Response, session
+from flask import Flask, render_template, request, jsonify, Response, session, abort
 import csv
 import os
+import json
+import hashlib
+import threading
+import sqlite3
+import uuid
+import time
+import collections
+import contextlib
 from io import StringIO
-import segbase
-from rules import Rule
-pbase = segbase.Segbase('data/ipa2spe.txt')
+from ursus import segbase
+from ursus.rules import Rule, Cascade
+from ursus.errors import ModelError
+pbase = segbase.Segbase.from_snapshot(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'ipa2spe.txt'))
 
 app = Flask(__name__)
 app.secret_key = 'FLASK_SECRET'
@@ -13,88 +22,369 @@ app.secret_key = 'FLASK_SECRET'
 # words = list()
 # word_entries = [{"word": "", "result": ""}]
 
+#compiled rulesets, shared by every request and keyed by ruleset_hash
+compiled_rulesets = collections.OrderedDict()
+compiled_rulesets_lock = threading.Lock()
+max_compiled_rulesets = 256
+
+def ruleset_hash(rules):
+    return hashlib.sha1('\n'.join(rules).encode('utf-8')).hexdigest()
+
+def compile_ruleset(rules):
+    """
+    Return the hash of a list of rule strings, and a (rules, compiled rules, cascade) tuple.
+    Rulesets are compiled once and kept for later requests, up to max_compiled_rulesets
+    """
+    key = ruleset_hash(rules)
+    with compiled_rulesets_lock:
+        if key in compiled_rulesets:
+            compiled_rulesets.move_to_end(key)
+            return key, compiled_rulesets[key]
+    compiled = [Rule(rule).compile(pbase) for rule in rules]
+    entry = (list(rules), compiled, Cascade(compiled, pbase))
+    with compiled_rulesets_lock:
+        compiled_rulesets[key] = entry
+        if len(compiled_rulesets) > max_compiled_rulesets:
+            compiled_rulesets.popitem(last=False)
+    return key, entry
+
+def get_compiled_ruleset(key):
+    with compiled_rulesets_lock:
+        entry = compiled_rulesets.get(key)
+        if entry is not None:
+            compiled_rulesets.move_to_end(key)
+        return entry
+
+#set by ursus.serve to a concurrent.futures executor, so that large batches don't hold up other requests
+rule_pool = None
+batch_size = 500 #words per chunk of a batch
+
+def apply_batch(rules, words, trace=True, ignore=()):
+    """
+    Apply a list of rule strings to a list of words. Returns the NDJSON lines for /apply_rules_batch,
+    one per word. This can run in a worker process, where the ruleset is compiled once and cached.
+    A word that the rules can't be applied to (e.g. it has a symbol that isn't in the Segbase)
+    gets a line with an error instead of a result, whatever the error is, so the other words still get theirs.
+    """
+    key, (rules, compiled, cascade) = compile_ruleset(rules)
+    ignore = set(ignore)
+    results = dict() #repeated words are only changed once
+    lines = list()
+    for word in words:
+        if word not in results:
+            try:
+                if trace or ignore:
+                    result, steps = trace_word(word, rules, compiled, ignore)
+                else:
+                    result, steps = cascade.apply(word), None
+                line = {'word': word, 'result': result}
+                if trace:
+                    line['rules_applied'] = steps
+            except Exception as e:
+                line = error_line(word, e)
+            results[word] = json.dumps(line, ensure_ascii=False) + '\n'
+        lines.append(results[word])
+    return lines
+
+def error_line(word, error):
+    return {'word': word, 'error': f'Could not apply the rules: {error!r}'}
+
+def trace_word(word, rules, compiled, ignore=()):
+    """
+    Apply each rule to word in order. Returns the result, and a list of {"rule": ..., "result": ...}
+    for every rule that changed the word
+    """
+    trace = list()
+    for text, rule in zip(rules, compiled):
+        if text in ignore:
+            continue
+        word, applied = rule.apply(word, pbase)
+        if applied:
+            trace.append({'rule': text, 'result': word})
+    return word, trace
+
+class RulesetStore:
+    """
+    Keeps each user's rules, words and last results table on the server, so that the session
+    cookie only has to hold an ID. Rules are compiled with compile_ruleset when they are applied.
+    path : optional SQLite file, so that rulesets survive a restart and are shared by every server
+    process (see ursus.serve). Without it everything is kept in memory, in this process only.
+    max_entries : the number of rulesets to keep in memory, least recently used first out. Without an
+    SQLite file that is all there is (every visit to / starts a new ruleset, so old ones are forgotten).
+    With one, memory is a cache in front of the file, which is only correct while a single process
+    writes to it. ursus.serve sets this to 0 when it runs several server processes.
+    max_age : with an SQLite file, rulesets that haven't been changed for this many seconds are deleted
+    (checked at most once an hour, when a ruleset is created), so the file doesn't grow forever
+    """
+
+    fields = ('rules', 'words', 'table')
+
+    def __init__(self, path=None, max_entries=10000, max_age=30*24*60*60):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.pruned = 0
+        self.entries = collections.OrderedDict()
+        self.lock = threading.RLock()
+        self.connection = None
+        self.pid = None
+
+    def connect(self):
+        """
+        Return the SQLite connection. Each process opens its own connection, because a connection
+        can't be used after the server forks.
+        """
+        if self.connection is None or self.pid != os.getpid():
+            self.connection = sqlite3.connect(self.path, check_same_thread=False)
+            self.connection.execute('CREATE TABLE IF NOT EXISTS rulesets (id TEXT PRIMARY KEY, rules TEXT, words TEXT, rules_table TEXT, used REAL)')
+            columns = [row[1] for row in self.connection.execute('PRAGMA table_info(rulesets)')]
+            if 'used' not in columns:
+                #a file from before rulesets were pruned, count them as used now
+                self.connection.execute('ALTER TABLE rulesets ADD COLUMN used REAL')
+                self.connection.execute('UPDATE rulesets SET used = ?', (time.time(),))
+            self.connection.commit()
+            self.pid = os.getpid()
+        return self.connection
+
+    def create(self):
+        ruleset_id = uuid.uuid4().hex
+        self.save(ruleset_id, {field: list() for field in self.fields})
+        if self.path and time.time() - self.pruned > 60*60:
+            self.prune()
+        return ruleset_id
+
+    def prune(self):
+        """
+        Delete the rulesets in the SQLite file that haven't been changed for max_age seconds
+        """
+        with self.lock:
+            connection = self.connect()
+            connection.execute('DELETE FROM rulesets WHERE used < ?', (time.time() - self.max_age,))
+            connection.commit()
+            self.entries.clear() #some of these may have been deleted
+            self.pruned = time.time()
+
+    def get(self, ruleset_id):
+        """
+        Return a dictionary of rules, words and table for ruleset_id. Raises KeyError for unknown IDs
+        """
+        with self.lock:
+            entry = self.entries.get(ruleset_id)
+            if entry is not None:
+                self.entries.move_to_end(ruleset_id)
+                return entry
+            if not self.path:
+                raise KeyError(ruleset_id)
+            row = self.connect().execute('SELECT rules, words, rules_table FROM rulesets WHERE id = ?', (ruleset_id,)).fetchone()
+            if row is None:
+                raise KeyError(ruleset_id)
+            entry = dict(zip(self.fields, [json.loads(value) for value in row]))
+            self.cache(ruleset_id, entry)
+        return entry
+
+    @contextlib.contextmanager
+    def edit(self, ruleset_id):
+        """
+        Read ruleset_id, and save it when the with block ends. The lock (and an SQLite transaction)
+        is held the whole time, so two requests that change the same ruleset don't lose either change:
+
+            with store.edit(ruleset_id) as entry:
+                entry['rules'].append(rule)
+        """
+        with self.lock:
+            if self.path:
+                self.connect().execute('BEGIN IMMEDIATE') #also keeps other processes out until the commit in save
+            try:
+                entry = {field: list(value) for field, value in self.get(ruleset_id).items()}
+                yield entry
+                self.save(ruleset_id, entry)
+            except BaseException:
+                if self.path:
+                    self.connect().rollback()
+                raise
+
+    def update(self, ruleset_id, **fields):
+        with self.edit(ruleset_id) as entry:
+            entry.update(fields)
+        return entry
+
+    def save(self, ruleset_id, entry):
+        with self.lock:
+            if self.path:
+                connection = self.connect()
+                connection.execute('INSERT OR REPLACE INTO rulesets (id, rules, words, rules_table, used) VALUES (?, ?, ?, ?, ?)',
+                                   [ruleset_id] + [json.dumps(entry[field], ensure_ascii=False) for field in self.fields] + [time.time()])
+                connection.commit()
+            self.cache(ruleset_id, entry)
+
+    def cache(self, ruleset_id, entry):
+        with self.lock:
+            self.entries[ruleset_id] = entry
+            self.entries.move_to_end(ruleset_id)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def compiled(self, ruleset_id):
+        """
+        Return the hash and (rules, compiled rules, cascade) for the rules in ruleset_id, see compile_ruleset
+        """
+        return compile_ruleset(self.get(ruleset_id)['rules'])
+
+store = RulesetStore(os.environ.get('URSUS_RULESET_DB'))
+
+def current_ruleset_id(data=None):
+    """
+    Return the ruleset ID sent with the request (as ruleset_id in the JSON body, form or query string),
+    or the one saved in the session. Stops with a 404 if the ID is unknown.
+    """
+    ruleset_id = None
+    if data:
+        ruleset_id = data.get('ruleset_id')
+    if not ruleset_id:
+        ruleset_id = request.values.get('ruleset_id') or session.get('ruleset_id')
+    if not ruleset_id:
+        ruleset_id = store.create()
+        session['ruleset_id'] = ruleset_id
+    try:
+        store.get(ruleset_id)
+    except KeyError:
+        abort(404, description=f'Unknown ruleset "{ruleset_id}"')
+    return ruleset_id
+
 @app.route('/')
 def index():
-    #if not 'rules' in session:
-    session['rules'] = list()
-    return render_template('index.html', rules=session['rules'])#, word_entries=word_entries)
-
-# @app.route('/add_rule', methods=['POST'])
-# def add_rule():
-#     rule = request.form['rule']
-#     rules.append(Rule(rule))
-#     return jsonify(success=True)
+    #every visit starts with no rules, like before rulesets were stored. The session's ruleset is reused
+    #(keeping its words), so that reloading the page doesn't leave a new ruleset behind each time
+    ruleset_id = session.get('ruleset_id')
+    try:
+        store.update(ruleset_id, rules=list())
+    except KeyError:
+        ruleset_id = store.create()
+        session['ruleset_id'] = ruleset_id
+    return render_template('index.html', rules=list(), ruleset_id=ruleset_id)
 
 @app.route('/add_rule', methods=['POST'])
 def add_rule():
     rule = request.form['rule']
-    if 'rules' not in session:
-        session['rules'] = [rule]
-    else:
-        ruleset = session['rules']
-        ruleset.append(rule)
-        session['rules'] = ruleset
-    return jsonify(success=True)
+    ruleset_id = current_ruleset_id()
+    with store.edit(ruleset_id) as entry:
+        entry['rules'].append(rule)
+    return jsonify(success=True, ruleset_id=ruleset_id)
 
 @app.route('/apply_rules', methods=['POST'])
 def apply_rules():
     data = request.get_json()
-    words = data['words']
+    ruleset_id = current_ruleset_id(data)
+    words = data.get('words')
+    if words is None:
+        words = store.get(ruleset_id)['words']
     results = list()
     rules_applied = list()
-    rules_to_ignore = data['ignoreRules']
-    print(rules_to_ignore)
+    rules_to_ignore = data.get('ignoreRules', list())
+    key, (rules, compiled, cascade) = store.compiled(ruleset_id)
     for word in words:
-        rules_for_this_word = list()
-        for rule in session['rules']:
-            if str(rule) in rules_to_ignore:
-                applied = False
-            else:
-                word, applied = Rule(rule).apply(word, pbase)
-            if applied:
-                rules_for_this_word.append(str(rule))
+        word, trace = trace_word(word, rules, compiled, rules_to_ignore)
         results.append(word)
-        rules_applied.append('<br>'.join(rules_for_this_word))
+        rules_applied.append('<br>'.join(step['rule'] for step in trace))
 
     changes = [{"word": word, "result": result, "rules_applied": applied} for (word, result, applied) in zip(words, results, rules_applied)]
-    session['rules_table'] = changes
-    return jsonify(word_entries=changes)
+    store.update(ruleset_id, table=changes)
+    return jsonify(word_entries=changes, ruleset_id=ruleset_id)
+
+@app.route('/apply_rules_batch', methods=['POST'])
+def apply_rules_batch():
+    """
+    Apply a ruleset to a list of words, without using the session. The request is JSON with:
+    rules : list of rule strings, or
+    ruleset : the hash returned by an earlier request, so the rules don't have to be sent again
+    words : list of words
+    trace : if true (the default), include the rules that applied to each word
+    ignoreRules : optional list of rules to skip (only when tracing)
+    The response is newline-delimited JSON: a first line with the ruleset hash, then one line per word.
+    The status is sent before the rules are applied, so problems with a word are reported on its line,
+    as {"word": ..., "error": ...}
+    """
+    data = request.get_json()
+    if data.get('rules') is not None:
+        try:
+            key, (rules, compiled, cascade) = compile_ruleset(data['rules'])
+        except (ValueError, KeyError, ModelError) as e:
+            return jsonify(error=f'Could not read the rules: {e}'), 400
+    else:
+        key = data.get('ruleset')
+        entry = get_compiled_ruleset(key)
+        if entry is None:
+            return jsonify(error=f'Unknown ruleset "{key}", send the rules instead'), 404
+        rules, compiled, cascade = entry
+    words = data.get('words', list())
+    if not isinstance(words, list) or not all(isinstance(word, str) for word in words):
+        #checked before the 200 is sent, see above
+        return jsonify(error='words must be a list of strings'), 400
+    trace = data.get('trace', True)
+    ignore = data.get('ignoreRules', list())
+    if not isinstance(ignore, list) or not all(isinstance(rule, str) for rule in ignore):
+        return jsonify(error='ignoreRules must be a list of strings'), 400
+    unique = list(dict.fromkeys(words)) #repeated words are only changed once, even in different chunks
+    chunks = [unique[j:j+batch_size] for j in range(0, len(unique), batch_size)]
+
+    def generate():
+        yield json.dumps({'ruleset': key, 'rules': len(rules), 'words': len(words)}) + '\n'
+        if rule_pool is not None and len(chunks) > 1:
+            #send the chunks to the pool all at once, and stream them back in order as they finish
+            results = [rule_pool.submit(apply_batch, rules, chunk, trace, ignore).result for chunk in chunks]
+        else:
+            results = (lambda chunk=chunk: apply_batch(rules, chunk, trace, ignore) for chunk in chunks)
+        pending = zip(chunks, results)
+        done = dict()
+        lines = list()
+        for word in words:
+            while word not in done:
+                #the first time a word appears, its chunk is the next one that hasn't been read yet
+                if lines:
+                    yield ''.join(lines)
+                    lines.clear()
+                chunk, result = next(pending)
+                try:
+                    chunk_lines = result()
+                except Exception as e:
+                    #e.g. a pool process died, every word in the chunk still gets a line
+                    chunk_lines = [json.dumps(error_line(word, e), ensure_ascii=False) + '\n' for word in chunk]
+                done.update(zip(chunk, chunk_lines))
+            lines.append(done[word])
+        if lines:
+            yield ''.join(lines)
+
+    return Response(generate(), mimetype='application/x-ndjson')
 
 @app.route('/remove_rule', methods=['POST'])
 def remove_rule():
-    index = request.form['index']
-    index = int(index)
-    if 'rules' in session:
-        ruleset = session['rules']
-        ruleset.pop(index)
-        session['rules'] = ruleset
+    index = int(request.form['index'])
+    ruleset_id = current_ruleset_id()
+    with store.edit(ruleset_id) as entry:
+        entry['rules'] = entry['rules'][:index] + entry['rules'][index+1:]
     return jsonify(success=True)
 
 @app.route('/remove_word', methods=['POST'])
 def remove_word():
     data = request.get_json()
     index = data['index']
-    if 'words' in session:
-        wordlist = session['words']
-        wordlist.pop(index)
-        session['words'] = wordlist
+    ruleset_id = current_ruleset_id(data)
+    with store.edit(ruleset_id) as entry:
+        entry['words'] = entry['words'][:index] + entry['words'][index+1:]
     return jsonify(success=True)
 
 @app.route('/add_word', methods=['POST'])
 def add_word():
     data = request.get_json()
     word = data['word']
-    if 'words' not in session:
-        session['words'] = [word]
-    else:
-        wordlist = session['word']
-        wordlist.append(word)
-        session['word'] = wordlist
+    ruleset_id = current_ruleset_id(data)
+    with store.edit(ruleset_id) as entry:
+        entry['words'].append(word)
     return jsonify(success=True)
 
 @app.route('/export_rules')
 def export_rules():
-    output = '\n'.join(session['rules'])
+    output = '\n'.join(store.get(current_ruleset_id())['rules'])
     return Response(
         output,
         mimetype="text/csv",
@@ -106,22 +396,24 @@ def export_rules():
 def move_down():
     data = request.get_json()
     index = data['index']
-    ruleset = session['rules']
-    if index < len(ruleset) - 1:  # Ensure there is a next element to swap with
-        ruleset[index], ruleset[index + 1] = ruleset[index + 1], ruleset[index]
-        session['rules'] = ruleset
-        return jsonify(message="Moved down successfully!")
+    ruleset_id = current_ruleset_id(data)
+    with store.edit(ruleset_id) as entry:
+        ruleset = entry['rules']
+        if index < len(ruleset) - 1:  # Ensure there is a next element to swap with
+            ruleset[index], ruleset[index + 1] = ruleset[index + 1], ruleset[index]
+            return jsonify(message="Moved down successfully!")
     return jsonify(message="Move down not possible.")
 
 @app.route('/move_up', methods=['POST'])
 def move_up():
     data = request.get_json()
     index = data['index']
-    ruleset = session['rules']
-    if index > 0:  # Ensure there is a previous element to swap with
-        ruleset[index], ruleset[index - 1] = ruleset[index - 1], ruleset[index]
-        session['rules'] = ruleset
-        return jsonify(message="Moved up successfully!")
+    ruleset_id = current_ruleset_id(data)
+    with store.edit(ruleset_id) as entry:
+        ruleset = entry['rules']
+        if index > 0:  # Ensure there is a previous element to swap with
+            ruleset[index], ruleset[index - 1] = ruleset[index - 1], ruleset[index]
+            return jsonify(message="Moved up successfully!")
     return jsonify(message="Move up not possible.")
 
 @app.route('/export_csv')
@@ -129,9 +421,8 @@ def export_csv():
     si = StringIO()
     cw = csv.writer(si)
     cw.writerow(['Input', 'Output', 'Rules Applied'])
-    if 'rules_table' in session:
-        for entry in session['rules_table']:
-            cw.writerow([entry['word'], entry['result'], entry['rules_applied']])
+    for entry in store.get(current_ruleset_id())['table']:
+        cw.writerow([entry['word'], entry['result'], entry['rules_applied']])
 
     output = si.getvalue()
     si.close()
@@ -144,10 +435,10 @@ def export_csv():
 
 @app.route('/clear_session')
 def clear_session():
-    print('clearing session rules: ', session['rules'])
-    session['rules'] = list()
-    session['words'] = list()
+    ruleset_id = current_ruleset_id()
+    print('clearing session rules: ', store.get(ruleset_id)['rules'])
+    store.update(ruleset_id, rules=list(), words=list())
     return jsonify(success=True)
 
 if __name__ == '__main__':
-    app.run()
\ No newline at end of file
+    app.run()
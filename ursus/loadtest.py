@@ -0,0 +1,121 @@
+"""
+Send many concurrent requests to /apply_rules_batch and report the latency percentiles:
+
+    python -m ursus.loadtest --requests 200 --concurrency 16 --words 2000
+
+Use --serve to start a server with ursus.serve for the test, otherwise one must already be running at --url.
+"""
+
+import sys
+import json
+import time
+import random
+import argparse
+import subprocess
+import urllib.request
+import urllib.error
+import concurrent.futures
+
+RULES = ['@ -> j / [-cons,+voc]_[-cons,+voc]',
+         'x -> h / _[-back,+voc,-cons]',
+         'p -> px / #_',
+         't -> s / _t',
+         'a -> e / _i',
+         '[-voice,+cons] -> +voice / [-cons]_[-cons]']
+
+def make_words(n, seed=0):
+    rng = random.Random(seed)
+    return [''.join(rng.choice('ptkbdgmnszlrxh') + rng.choice('aeiou') for _ in range(rng.randint(1, 4))) for _ in range(n)]
+
+def post(url, payload, timeout=300):
+    """
+    POST payload as JSON and read the whole response. Returns the time it took in seconds, and the HTTP status
+    """
+    data = json.dumps(payload).encode('utf-8')
+    req = urllib.request.Request(url, data=data, headers={'Content-Type': 'application/json'})
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as response:
+            response.read()
+            status = response.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    return time.perf_counter() - start, status
+
+def percentile(values, p):
+    """
+    Return the p-th percentile (0-100) of values, by the nearest-rank method
+    """
+    values = sorted(values)
+    rank = max(1, -(-len(values) * p // 100))
+    return values[int(rank) - 1]
+
+def run_load_test(url, rules, words, requests=100, concurrency=8, trace=True):
+    """
+    Send requests batches of words to the /apply_rules_batch endpoint at url, concurrency at a time.
+    Returns a dictionary of latency statistics, in seconds
+    """
+    endpoint = url.rstrip('/') + '/apply_rules_batch'
+    post(endpoint, {'rules': rules, 'words': words[:10]}) #warm up, so the ruleset is compiled before timing
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(lambda j: post(endpoint, {'rules': rules, 'words': words, 'trace': trace}), range(requests)))
+    elapsed = time.perf_counter() - start
+    latencies = [seconds for seconds, status in results]
+    return {'requests': requests,
+            'concurrency': concurrency,
+            'words_per_request': len(words),
+            'errors': sum(1 for seconds, status in results if status != 200),
+            'seconds': elapsed,
+            'requests_per_second': requests / elapsed,
+            'words_per_second': requests * len(words) / elapsed,
+            'p50': percentile(latencies, 50),
+            'p90': percentile(latencies, 90),
+            'p99': percentile(latencies, 99),
+            'max': max(latencies)}
+
+def wait_for_server(url, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            post(url.rstrip('/') + '/apply_rules_batch', {'rules': list(), 'words': list()}, timeout=1)
+            return True
+        except (urllib.error.URLError, ConnectionError):
+            time.sleep(0.2)
+    return False
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(prog='ursus.loadtest', description='Load test the ursus rule app')
+    parser.add_argument('-u', '--url', dest='url', default='http://127.0.0.1:5000', help='Address of the rule app')
+    parser.add_argument('-n', '--requests', dest='requests', default=100, type=int, help='Number of requests to send')
+    parser.add_argument('-c', '--concurrency', dest='concurrency', default=8, type=int, help='Number of requests to have open at once')
+    parser.add_argument('-wn', '--words', dest='words', default=1000, type=int, help='Number of words in each request')
+    parser.add_argument('-r', '--rules', dest='rules_file', default=None, help='A sound change file to use instead of the built-in rules')
+    parser.add_argument('--no_trace', dest='trace', default=True, action='store_false', help='Ask for results without rule traces')
+    parser.add_argument('--serve', dest='serve', default=False, action='store_true', help='Start ursus.serve on the port in --url for the test')
+    parser.add_argument('--serve_args', dest='serve_args', default='', help='Extra arguments for ursus.serve, e.g. "--pool 4"')
+    args = parser.parse_args()
+
+    rules = RULES
+    if args.rules_file:
+        with open(args.rules_file, encoding='utf-8') as f:
+            rules = [line.strip() for line in f if line.strip()]
+
+    server = None
+    if args.serve:
+        port = args.url.rsplit(':', 1)[-1].strip('/')
+        server = subprocess.Popen([sys.executable, '-m', 'ursus.serve', '--port', port] + args.serve_args.split())
+        if not wait_for_server(args.url):
+            server.terminate()
+            sys.exit('The server did not start')
+    try:
+        report = run_load_test(args.url, rules, make_words(args.words), args.requests, args.concurrency, args.trace)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    print(f'{report["requests"]} requests of {report["words_per_request"]} words, {report["concurrency"]} at a time, {report["errors"]} errors')
+    print(f'{report["requests_per_second"]:.1f} requests/s, {report["words_per_second"]:.0f} words/s')
+    print(f'latency p50 {report["p50"]*1000:.1f}ms  p90 {report["p90"]*1000:.1f}ms  p99 {report["p99"]*1000:.1f}ms  max {report["max"]*1000:.1f}ms')
@@ -1,3 +1,15 @@
+class Wildcard:
+    """
+    Stands in for a '*' position in a compiled rule. It contains every segment except '?'
+    """
+
+    def __contains__(self, segment):
+        return segment != '?'
+
+    def __repr__(self):
+        return '*'
+
+
 class Rule:
 
     def __init__(self, text):
@@ -14,6 +26,36 @@ class Rule:
         c, d = rhs.split('_')
         self.c = c.strip().strip('{}[]').split(',')
         self.d = d.strip().strip('{}[]').split(',')
+        self.pbase = None #the Segbase this rule was last compiled against, see Rule.compile
+
+    def compile(self, pbase):
+        """
+        Resolve the a, c and d positions of this rule into sets of segment symbols, using the
+        features in pbase. Afterwards, Rule.apply checks each segment of a word with a simple
+        set membership test instead of calling Rule.matches.
+        Symbols that are not in pbase never match a feature bundle in a compiled rule.
+        Returns the rule itself, so that you can write Rule(text).compile(pbase)
+        """
+        self.a_set = self.compile_segment(self.a, pbase)
+        self.c_set = self.compile_segment(self.c, pbase)
+        self.d_set = self.compile_segment(self.d, pbase)
+        self.transforms = dict() #segment -> output, filled in by Rule.transform
+        self.pbase = pbase
+        return self
+
+    def compile_segment(self, rule_segment, pbase):
+        if rule_segment[0] == '*':
+            return Wildcard()
+
+        if rule_segment == ['#']:
+            return frozenset(rule_segment)
+
+        if rule_segment[0][:1] in ['+', '-']:
+            #a feature bundle, find every segment that has all of these features
+            return pbase.segments_matching(rule_segment)
+
+        #a list of segments, word boundaries only match when they are alone (see above)
+        return frozenset(rule_segment) - {'#', '?'}
 
     def matches(self, word_segment, rule_segment, pbase):
         if word_segment == '?':
@@ -46,6 +88,13 @@ class Rule:
 
     def transform(self, segment, pbase):
         if self.b[0] in ['+', '-']:
+            if self.pbase is pbase:
+                #compiled rule, each segment only has to be looked up once
+                #this also means a tie between symbols is only broken once per segment
+                try:
+                    return self.transforms[segment]
+                except KeyError:
+                    pass
             b_features = self.b.split(',')
             #it's a feature bundle, we have to transform the input segment's feature list and look up a new symbol
             seg_features = ','.join(pbase.segments[segment].feature_list)
@@ -58,6 +107,8 @@ class Rule:
                     seg_features = seg_features.replace('+'+b_name, b_feature)
             seg_features = seg_features.split(',')
             new_segment = pbase.choose_symbol_from_features(seg_features)
+            if self.pbase is pbase:
+                self.transforms[segment] = new_segment.symbol
             return new_segment.symbol
 
         else:
@@ -65,24 +116,35 @@ class Rule:
             return self.b
 
     def apply(self, word, pbase):
+        if self.pbase is pbase:
+            #compiled rule, every check is a set lookup
+            match_a = self.a_set.__contains__
+            match_c = self.c_set.__contains__
+            match_d = self.d_set.__contains__
+        else:
+            match_a = lambda segment: self.matches(segment, self.a, pbase)
+            match_c = lambda segment: self.matches(segment, self.c, pbase)
+            match_d = lambda segment: self.matches(segment, self.d, pbase)
+
+        insertion = self.a == ['@'] or self.a == ['Ø']
         applied = False
         new_word = [w for w in word] #this crucially assumes there are no digraphs!
         for index, segment in enumerate(word[:]):
             #print(self.a)
-            if self.a == ['@'] or self.a == ['Ø']:
+            if insertion:
                 #it's an insertion rule
                 check_left = word[index-1] if index > 0 else '#'
                 check_right = segment
                 #print('environment:', check_left, check_right)
-                if self.matches(check_left, self.c, pbase) and self.matches(check_right, self.d, pbase):
+                if match_c(check_left) and match_d(check_right):
                     applied = True
                     new_word.insert(index, self.b)
                     #print('applied!')
                     #print(new_word)
-            if self.matches(segment, self.a, pbase):
+            if match_a(segment):
                 check_left = new_word[index-1] if index > 0 else '#'
                 check_right = new_word[index+1] if index < len(word)-1 else '#'
-                if self.matches(check_left, self.c, pbase) and self.matches(check_right, self.d, pbase):
+                if match_c(check_left) and match_d(check_right):
                     applied = True
                     #new_word.append(self.transform(segment))
                     new_word[index] = self.transform(segment, pbase)
@@ -114,3 +176,96 @@ class Rule:
     def __eq__(self, other):
         return str(self) == str(other)
 
+
+
+class Cascade:
+    """
+    An ordered list of rules compiled together against one Segbase, so that a word can be run
+    through the whole list in a few passes instead of one pass per rule.
+    rules : a list of Rule objects, in the order they apply
+    pbase : the Segbase used to compile the rules
+
+    Runs of context-free rules (like 'e -> i / _') are composed into a single translation table
+    and applied with str.translate in one pass. Every other rule is compiled and only applied
+    if the word contains at least one of its trigger segments.
+    Words that contain placeholders ('?', '@' or 'Ø') go through the rules one by one, because
+    those symbols change how the environments of the following rules are checked.
+    Feature-changing rules in a translation table are resolved once, when the cascade is built,
+    so any random tie-breaking in Segbase.choose_symbol_from_features happens only once.
+    """
+
+    def __init__(self, rules, pbase):
+        self.pbase = pbase
+        self.rules = [rule if rule.pbase is pbase else rule.compile(pbase) for rule in rules]
+        self.stages = list()
+
+        table = None
+        for rule in self.rules:
+            if '?' in rule.b:
+                #the output of this rule would block later environments, don't try to be clever
+                self.stages = None
+                return
+            mapping = self.context_free_mapping(rule)
+            if mapping is None:
+                if table is not None:
+                    self.stages.append({ord(k): v for k, v in table.items()})
+                    table = None
+                self.stages.append(rule)
+            elif table is None:
+                table = mapping
+            else:
+                table = self.compose(table, mapping)
+        if table is not None:
+            self.stages.append({ord(k): v for k, v in table.items()})
+
+    def context_free_mapping(self, rule):
+        """
+        Return a dictionary of segment -> output for a rule that applies everywhere, or None if
+        the rule has an environment, is an insertion, or can't be resolved ahead of time
+        """
+        if rule.a == ['@'] or rule.a == ['Ø']:
+            return None
+        if not isinstance(rule.c_set, Wildcard) or not isinstance(rule.d_set, Wildcard):
+            return None
+        if isinstance(rule.a_set, Wildcard):
+            return None
+
+        mapping = dict()
+        for segment in rule.a_set:
+            if len(segment) != 1:
+                continue #words are read one character at a time, so this can never match
+            try:
+                output = rule.transform(segment, self.pbase)
+            except KeyError:
+                return None
+            mapping[segment] = output.replace('@', '').replace('Ø', '')
+        return mapping
+
+    def compose(self, first, second):
+        """
+        Return a table that has the same effect as applying first, then second
+        """
+        table = dict()
+        for segment in set(first) | set(second):
+            output = first.get(segment, segment)
+            table[segment] = ''.join(second.get(s, s) for s in output)
+        return table
+
+    def apply(self, word):
+        if self.stages is None or '?' in word or '@' in word or 'Ø' in word:
+            for rule in self.rules:
+                word, applied = rule.apply(word, self.pbase)
+            return word
+
+        for stage in self.stages:
+            if isinstance(stage, dict):
+                word = word.translate(stage)
+            elif isinstance(stage.a_set, frozenset) and stage.a_set.isdisjoint(word) \
+                    and stage.a != ['@'] and stage.a != ['Ø']:
+                continue #nothing in this word can trigger the rule
+            else:
+                word, applied = stage.apply(word, self.pbase)
+        return word
+
+    def __len__(self):
+        return len(self.rules)
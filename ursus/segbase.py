@@ -5,9 +5,30 @@ import codecs
 import random
 import itertools
 import os
+import pickle
+import hashlib
+import tempfile
+import operator
 from .phonology import *
+from .errors import ModelError
 import string
 
+np = None #only needed for backend='numpy', see import_numpy
+
+def import_numpy():
+    """
+    Import numpy the first time a FeatureMatrix needs it, because importing it takes longer
+    than everything else GLOM does at startup
+    """
+    global np
+    if np is None:
+        try:
+            import numpy
+        except ImportError:
+            raise ModelError('The numpy backend for Segbase needs numpy. Install it with "pip install numpy"')
+        np = numpy
+    return np
+
 class Segbase(object):
     """
     This object contains all of the Segments that could potentially appear in a PyILM simulation
@@ -24,10 +45,18 @@ class Segbase(object):
     phoneme_prediction = what to do when trying to generate a label from a set of features. 'rules' uses some basic
     rules to compare +/- values and pick symbol with most matches, 'model' loads a feedforward network trained to predict
     phoneme symbols based on phonological features
+    backend = 'python' keeps features only in the Segment objects, 'numpy' also builds a FeatureMatrix
+    which is used for feature bundle matching, choose_symbol_from_features and find_minimum_contrasts
+    seed = if not None, ties in choose_symbol_from_features are broken by a random.Random(seed) that belongs
+    to this Segbase, so the same inputs always get the same symbols. Otherwise the random module is used.
     """
 
+    #increase this when the attributes of a Segbase change, so that old snapshots are rebuilt
+    snapshot_version = 2
+
     def __init__(self,path=None, restricted_features=None, delimiter=',', givedetails=False,
-                 n_value=None, dot_value=None, init_seg_groups=False, phoneme_prediction='rules'):
+                 n_value=None, dot_value=None, init_seg_groups=False, phoneme_prediction='rules',
+                 backend='python', seed=None):
 
         if path is None:
             path = os.path.join(os.getcwd(), 'ursus', 'data', 'ipa2spe.txt')
@@ -93,9 +122,77 @@ class Segbase(object):
         if self.phoneme_prediction == 'model':
             self.phoneme_labeller = PhonemeLabeller('best_model_restricted_features.h5',
                                                 [segment for segment in self.segments])
+        self.matrix = FeatureMatrix(self) if backend == 'numpy' else None
+        self.rng = random.Random(seed) if seed is not None else None
+        self.sign_index = None #built by the first call to choose_symbol_from_features
 
 
 
+    @classmethod
+    def from_snapshot(cls, path=None, snapshot_path=None, **kwargs):
+        """
+        Load a Segbase from a pickled snapshot of the feature file at path, instead of parsing the
+        feature file again. If the snapshot is missing or out of date, the feature file is parsed
+        as usual and a new snapshot is saved.
+        A snapshot is out of date if the modification time and the hash of the feature file,
+        or any of the kwargs, are different from when it was saved.
+        snapshot_path : where to keep the snapshot, defaults to the path of the feature file + '.snapshot'
+        kwargs : passed on to Segbase.__init__
+        """
+        if path is None:
+            path = os.path.join(os.getcwd(), 'ursus', 'data', 'ipa2spe.txt')
+        if snapshot_path is None:
+            snapshot_path = path + '.snapshot'
+        if kwargs.get('phoneme_prediction') == 'model':
+            #the phoneme labeller can't be pickled
+            return cls(path, **kwargs)
+
+        mtime = os.path.getmtime(path)
+        options = repr((cls.snapshot_version, sorted(kwargs.items())))
+        source_hash = None
+        try:
+            with open(snapshot_path, 'rb') as f:
+                header = pickle.load(f)
+                if header['options'] == options:
+                    if header['mtime'] != mtime:
+                        source_hash = cls.hash_file(path)
+                    if header['mtime'] == mtime or header['hash'] == source_hash:
+                        return pickle.load(f)
+        except (OSError, EOFError, KeyError, TypeError, pickle.UnpicklingError):
+            pass #no usable snapshot, build a new one
+
+        segbase = cls(path, **kwargs)
+        #segments with the same feature value can share one Feature object, which makes the
+        #snapshot much smaller and faster to load (Features are not changed after __init__)
+        shared = dict()
+        for seg in segbase.segments.values():
+            for name, feature in seg.features.items():
+                seg.features[name] = shared.setdefault(str(feature), feature)
+
+        header = {'mtime': mtime,
+                  'hash': source_hash if source_hash is not None else cls.hash_file(path),
+                  'options': options}
+        #written to a temporary file that replaces the snapshot in one step, so another process that
+        #starts at the same time reads either the old snapshot or the whole new one, never half of it
+        temp_path = None
+        try:
+            with tempfile.NamedTemporaryFile(dir=os.path.dirname(os.path.abspath(snapshot_path)),
+                                             prefix=os.path.basename(snapshot_path), suffix='.tmp', delete=False) as f:
+                temp_path = f.name
+                pickle.dump(header, f, protocol=pickle.HIGHEST_PROTOCOL)
+                pickle.dump(segbase, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path, snapshot_path)
+        except OSError:
+            #read-only location, just go without a snapshot
+            if temp_path is not None and os.path.exists(temp_path):
+                os.remove(temp_path)
+        return segbase
+
+    @staticmethod
+    def hash_file(path):
+        with open(path, 'rb') as f:
+            return hashlib.sha1(f.read()).hexdigest()
+
     def get_consonants(self):
         return self.consonants
 
@@ -224,6 +321,9 @@ class Segbase(object):
 
     def find_minimum_contrasts(self,inventory):
 
+        if self.matrix is not None:
+            return self.matrix.minimum_contrasts(inventory)
+
         inventory = [self.segments[seg] for seg in inventory]
         contrasts = list()
         for seg1,seg2 in itertools.product(inventory,inventory):
@@ -239,6 +339,21 @@ class Segbase(object):
 
         return contrasts
 
+    def segments_matching(self, bundle):
+        """
+        Return a frozenset of the symbols whose features include every feature in bundle
+        bundle is a list of feature strings, e.g. ['+nasal', '-voc']
+        """
+        if self.matrix is not None:
+            return self.matrix.matching(bundle)
+
+        matching = list()
+        for symbol, seg in self.segments.items():
+            feature_list = seg.feature_list
+            if all(feature in feature_list for feature in bundle):
+                matching.append(symbol)
+        return frozenset(matching)
+
     def convert_features_to_binary(self, input_features, non_binary=0):
         """
         take a list of features and return a binary number
@@ -262,6 +377,23 @@ class Segbase(object):
         return binary_features
 
 
+    def build_sign_index(self):
+        """
+        Precompute the signs of each segment, in the order compared by choose_symbol_from_features,
+        and a dictionary from a complete tuple of signs to the first symbol that has them
+        """
+        #both are built first and assigned last, because choose_symbol_from_features only builds them while
+        #sign_index is None, so another thread must never see a half-built index
+        sorted_signs = dict()
+        sign_index = dict()
+        for symbol, seg in self.segments.items():
+            features = sorted(seg.features.values(), key=lambda f: f.name[0])
+            signs = tuple(f.sign for f in features)
+            sorted_signs[symbol] = signs
+            sign_index.setdefault(signs, symbol)
+        self.sorted_signs = sorted_signs
+        self.sign_index = sign_index
+
     def choose_symbol_from_features(self, input_list, exclude=None):
         """
         Takes a list of Feature objects as input, and finds an IPA symbol
@@ -274,7 +406,7 @@ class Segbase(object):
         if exclude is None:
             exclude = tuple()
 
-        input_list.sort(key=lambda x: x[1])  # sort by feature name
+        input_list = sorted(input_list, key=lambda x: x[1])  # sort by feature name, without changing the caller's list
         input_list = [f[0] for f in input_list]  # just get values, ignore names
 
         if self.phoneme_prediction == 'model':
@@ -287,27 +419,123 @@ class Segbase(object):
             #it compares the features values of the input set against all segbase segments and takes the highest score
             #in case of a tie, randomly select from the highest-scoring matches
 
+            if self.sign_index is None:
+                self.build_sign_index()
+
+            #most of the time there is a segment with exactly these features
+            symbol = self.sign_index.get(tuple(input_list))
+            if symbol is not None and symbol not in exclude:
+                return self.segments[symbol]
+
+            rng = self.rng if self.rng is not None else random
+            if self.matrix is not None:
+                return self.segments[self.matrix.nearest(input_list, exclude, rng)]
+
             seg_scores = dict()
-            segs = ((key,value.features) for (key,value) in self.segments.items() if key not in exclude)
+            segs = ((key,value) for (key,value) in self.sorted_signs.items() if key not in exclude)
 
             for symbol,features in segs:
-                score = 0
-                features = [str(features[f]) for f in features]
-                features.sort(key=lambda x:x[1])
-                features = [f[0] for f in features] #just get the values
-                score = sum([1 if f1==f2 else 0 for f1,f2 in zip(input_list, features)])
+                score = sum(map(operator.eq, input_list, features))
                 seg_scores[symbol] = score
                 if score == len(input_list): #max score
                     return self.segments[symbol]
 
             max_ = max(seg_scores.values())
             top_scores = [seg for seg in seg_scores.keys() if seg_scores[seg] == max_]
-            selected_seg = random.choice(top_scores)
+            selected_seg = rng.choice(top_scores)
 
 
 
         return self.segments[selected_seg]
 
+class FeatureMatrix(object):
+    """
+    The features of every segment in a Segbase, stored as a numpy int8 array with one row per
+    segment and one column per feature, so that features can be compared for all segments at once.
+    Signs are encoded using FeatureMatrix.codes, any other sign is stored as 0.
+    symbols : list of segment symbols, in the same order as the rows
+    index : dictionary of symbol -> row number
+    columns : dictionary of feature name -> column number
+    """
+
+    codes = {'+': 1, '-': 2, 'n': 3, '.': 4}
+
+    def __init__(self, segbase):
+        import_numpy()
+
+        self.symbols = list(segbase.segments)
+        self.index = {symbol: j for j, symbol in enumerate(self.symbols)}
+        first = segbase.segments[self.symbols[0]]
+        self.feature_names = list(first.features)
+        self.columns = {name: j for j, name in enumerate(self.feature_names)}
+
+        self.matrix = np.zeros((len(self.symbols), len(self.feature_names)), dtype=np.int8)
+        for row, symbol in enumerate(self.symbols):
+            for name, feature in segbase.segments[symbol].features.items():
+                if name in self.columns:
+                    self.matrix[row, self.columns[name]] = self.codes.get(feature.sign, 0)
+
+        #Segbase.choose_symbol_from_features compares features by position, after sorting them by the
+        #first letter of their name, so keep a copy of each row in that order
+        self.sorted_matrix = np.zeros_like(self.matrix)
+        for row, symbol in enumerate(self.symbols):
+            features = sorted(segbase.segments[symbol].features.values(), key=lambda f: f.name[0])
+            for column, feature in enumerate(features[:len(self.feature_names)]):
+                self.sorted_matrix[row, column] = self.codes.get(feature.sign, 0)
+
+    def __setstate__(self, state):
+        #unpickling (e.g. from a Segbase snapshot) recreates the arrays, but the methods below still need np
+        import_numpy()
+        self.__dict__.update(state)
+
+    def matching(self, bundle):
+        """
+        Return a frozenset of the symbols that have every feature in bundle, e.g. ['+nasal', '-voc']
+        """
+        mask = np.ones(len(self.symbols), dtype=bool)
+        for feature in bundle:
+            column = self.columns.get(feature[1:])
+            code = self.codes.get(feature[:1])
+            if column is None or code is None:
+                return frozenset()
+            mask &= self.matrix[:, column] == code
+        return frozenset(self.symbols[j] for j in np.flatnonzero(mask))
+
+    def nearest(self, signs, exclude=(), rng=random):
+        """
+        Return the symbol with the most signs in common with signs, a list of '+', '-', etc. in
+        the same order as Segbase.choose_symbol_from_features sorts them. The first exact match wins,
+        otherwise ties are broken with rng.choice, the same as Segbase.choose_symbol_from_features.
+        """
+        width = min(len(signs), self.sorted_matrix.shape[1])
+        target = np.array([self.codes.get(sign, -1) for sign in signs[:width]], dtype=np.int8)
+        scores = (self.sorted_matrix[:, :width] == target).sum(axis=1)
+
+        allowed = np.ones(len(self.symbols), dtype=bool)
+        for symbol in exclude:
+            if symbol in self.index:
+                allowed[self.index[symbol]] = False
+        scores = np.where(allowed, scores, -1)
+
+        exact = np.flatnonzero(scores == len(signs))
+        if len(exact):
+            return self.symbols[exact[0]]
+
+        best = scores[allowed].max()
+        top_scores = [self.symbols[j] for j in np.flatnonzero(scores == best)]
+        return rng.choice(top_scores)
+
+    def minimum_contrasts(self, inventory):
+        """
+        Return a list of the names of features that have different values in at least two segments of inventory
+        """
+        rows = self.matrix[[self.index[seg] for seg in inventory]]
+        if len(rows) == 0:
+            return list()
+        contrastive = (rows != rows[0]).any(axis=0)
+        return [self.feature_names[j] for j in np.flatnonzero(contrastive)]
+
+
 class Pbase(object):
     """
     This opens the inventories of P-base as a Python object
@@ -0,0 +1,108 @@
+"""
+Run the rule app (ursus.app) so that it can handle many requests at once:
+
+    URSUS_RULESET_DB=rulesets.db python -m ursus.serve --workers 4 --threads 8 --pool 4
+
+The Segbase snapshot is loaded once, when ursus.app is imported, before any other process is started.
+Forked processes share it copy-on-write instead of each loading their own.
+Batches sent to /apply_rules_batch are split into chunks that run in a process pool, so one large
+request doesn't hold up the others.
+
+gunicorn is used if it is installed, with --workers processes of --threads threads each, and the --pool
+processes shared out between the workers. Otherwise the app runs in Werkzeug's threaded server in one process,
+and the pool does the CPU-bound work. Set URSUS_RULESET_DB to an SQLite file so that every process sees the
+same rulesets, this is required for more than one worker.
+"""
+
+import os
+import sys
+import signal
+import argparse
+import multiprocessing
+import concurrent.futures
+from ursus import app as rule_app
+
+def create_pool(processes):
+    """
+    Return a process pool for ursus.app.apply_batch, or None if processes is 0.
+    Where fork is available, the pool's processes are forked from this one and share its Segbase.
+    Call this before the server starts its threads: the processes are started right away, because
+    a process forked while another thread holds a lock (e.g. in compile_ruleset) would never get it.
+    """
+    if processes < 1:
+        return None
+    try:
+        context = multiprocessing.get_context('fork')
+    except ValueError:
+        context = None #e.g. Windows, every process loads the snapshot itself
+    pool = concurrent.futures.ProcessPoolExecutor(max_workers=processes, mp_context=context)
+    #the executor only starts its processes when work is submitted, so give each one something to do now
+    for started in [pool.submit(int) for _ in range(processes)]:
+        started.result()
+    return pool
+
+def serve_gunicorn(host, port, workers, threads, pool):
+    from gunicorn.app.base import BaseApplication
+    if workers > 1 and not rule_app.store.path:
+        #each process would have its own rulesets, and a request that lands on another process gets a 404
+        sys.exit('Several workers need a shared ruleset store. Set URSUS_RULESET_DB to an SQLite file, or use --workers 1.')
+    #pool is the total, so that --workers 4 doesn't start 4 times as many pool processes as there are CPUs
+    pool_per_worker = max(1, pool // workers) if pool else 0
+    if workers > 1 and rule_app.store.path:
+        #rulesets cached in one process's memory would be out of date once another process changes them
+        rule_app.store.max_entries = 0
+
+    class Server(BaseApplication):
+
+        def load_config(self):
+            self.cfg.set('bind', f'{host}:{port}')
+            self.cfg.set('workers', workers)
+            self.cfg.set('threads', threads)
+            self.cfg.set('worker_class', 'gthread')
+            self.cfg.set('preload_app', True) #import the app (and load the Segbase) before forking
+            #post_fork runs in the new worker before its threads start, see create_pool
+            self.cfg.set('post_fork', lambda server, worker: setattr(rule_app, 'rule_pool', create_pool(pool_per_worker)))
+
+        def load(self):
+            return rule_app.app
+
+    Server().run()
+
+def serve_werkzeug(host, port, pool):
+    from werkzeug.serving import run_simple
+    rule_app.rule_pool = create_pool(pool)
+    #exit normally on SIGTERM too, so that the pool's processes are shut down and not left behind
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit())
+    try:
+        run_simple(host, port, rule_app.app, threaded=True)
+    finally:
+        if rule_app.rule_pool is not None:
+            rule_app.rule_pool.shutdown(cancel_futures=True)
+
+def serve(host='127.0.0.1', port=5000, workers=1, threads=8, pool=None, batch_size=None):
+    if pool is None:
+        pool = os.cpu_count() or 1
+    if batch_size:
+        rule_app.batch_size = batch_size
+    try:
+        import gunicorn
+    except ImportError:
+        gunicorn = None
+    if gunicorn is not None:
+        serve_gunicorn(host, port, workers, threads, pool)
+    else:
+        if workers > 1:
+            print('gunicorn is not installed, so the app runs in one process. Install gunicorn for --workers.')
+        serve_werkzeug(host, port, pool)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(prog='ursus.serve', description='Serve the ursus rule app with several workers')
+    parser.add_argument('--host', dest='host', default='127.0.0.1', help='Address to listen on, defaults to 127.0.0.1')
+    parser.add_argument('-p', '--port', dest='port', default=5000, type=int, help='Port to listen on, defaults to 5000')
+    parser.add_argument('-w', '--workers', dest='workers', default=1, type=int, help='Number of server processes (needs gunicorn)')
+    parser.add_argument('-t', '--threads', dest='threads', default=8, type=int, help='Number of threads in each server process (with gunicorn)')
+    parser.add_argument('-pp', '--pool', dest='pool', default=None, type=int, help='Number of processes for applying rules to large batches, in total across all workers. Defaults to the number of CPUs. 0 applies rules in the server threads.')
+    parser.add_argument('-bs', '--batch_size', dest='batch_size', default=None, type=int, help='Number of words in each chunk of a batch sent to the pool')
+    args = parser.parse_args()
+    serve(args.host, args.port, args.workers, args.threads, args.pool, args.batch_size)